@@ -0,0 +1,79 @@
+#
+# Bytes allocated per Tile.put, old (clone/mask products) vs current (in place) version
+#   python benchmarks/tile_put_memory.py [--size 2048] [--overlap 128] [--channels 4] [--blend 1.0]
+#
+import os
+import sys
+import argparse
+import torch
+import torchvision.transforms.functional as F
+from torch.profiler import profile, ProfilerActivity
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.slicing import Tile
+from core.utils import sanitize
+from core.mask import get_weight_mask, get_tile_edges
+
+def put_old(self, image, tile, mask=None, blend=1.0, scale=1.0):
+	"""
+	Tile.put before the in place blend, kept as-is for comparison
+	"""
+	image = sanitize(image)
+	tile = sanitize(tile)
+
+	if torch.is_tensor(mask):
+		mask = sanitize(mask).to(tile.dtype)
+		raw = self.crop(image, scale)
+		if mask.shape != tile.shape:
+			mask = F.resize(mask, tile.shape[2:], antialias=True)
+		if raw.shape != tile.shape:
+			raw = F.resize(raw, tile.shape[2:], antialias=True)
+		pos_mask = mask * blend
+		neg_mask = torch.ones_like(pos_mask) - pos_mask
+		tile = tile * pos_mask + raw * neg_mask
+
+	h_start = round(self.h_start*scale)
+	h_end   = round(self.h_end*scale)
+	w_start = round(self.w_start*scale)
+	w_end   = round(self.w_end*scale)
+	image[:, :, h_start:h_end,w_start:w_end] = tile
+	return image
+
+def measure(func, *args, **kwargs):
+	"""
+	Sum of all CPU allocations made by func (bytes), frees are ignored.
+	Self usage so allocations inside child ops are only counted once.
+	"""
+	with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+		func(*args, **kwargs)
+	return sum(x.self_cpu_memory_usage for x in prof.events() if x.self_cpu_memory_usage > 0)
+
+def main():
+	parser = argparse.ArgumentParser(description="Tile.put allocation benchmark")
+	parser.add_argument("--size", type=int, default=2048, help="tile size (px)")
+	parser.add_argument("--overlap", type=int, default=128, help="overlap with neighbours (px)")
+	parser.add_argument("--channels", type=int, default=4)
+	parser.add_argument("--blend", type=float, default=1.0)
+	args = parser.parse_args()
+
+	size, overlap = args.size, args.overlap
+	# inner tile, overlaps on all sides
+	image = torch.rand((1, args.channels, size*3, size*3))
+	tile = Tile((size*2-overlap, size*3-overlap), (size*2-overlap, size*3-overlap), 1, 1, 2, 2)
+	tile_image = torch.rand((1, args.channels, size, size))
+	# blend mask with the same shape as the tile, like the mask builder output
+	mask = get_weight_mask(tile_image.shape, get_tile_edges(tile)).repeat(1, args.channels, 1, 1)
+
+	# warm-up so lazy init (resize kernels, etc) isn't counted
+	put_old(tile, image, tile_image, mask, args.blend)
+	tile.put(image, tile_image, mask, args.blend)
+
+	old = measure(put_old, tile, image, tile_image, mask, args.blend)
+	new = measure(tile.put, image, tile_image, mask, args.blend)
+	full = tile_image.numel()*tile_image.element_size()
+	print(f"Tile {size}x{size}x{args.channels} float32, overlap {overlap}px, blend {args.blend} (1 tile = {full/1024**2:.0f}MiB)")
+	print(f"  old: {old/1024**2:8.1f}MiB allocated ({old/full:.2f} tiles)")
+	print(f"  new: {new/1024**2:8.1f}MiB allocated ({new/full:.2f} tiles)")
+
+if __name__ == "__main__":
+	main()
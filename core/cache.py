@@ -0,0 +1,120 @@
+#
+# Persistent tile result cache
+#
+import os
+import json
+import torch
+import hashlib
+from PIL import Image
+from threading import Lock
+from collections import OrderedDict
+from torchvision.transforms.functional import to_pil_image
+
+from .utils import sanitize, to_dtype, log
+
+CACHE_EXT = "png"
+
+class TileCache:
+	"""
+	Disk-backed, size-bounded LRU cache for processed tiles.
+	Keyed by a hash of the tile input pixels, the tile workflow (incl. seed) and the upscale factor.
+	"""
+	def __init__(self, path, max_size):
+		"""
+		path: folder to store cached tiles in
+		max_size: max. total size on disk (bytes)
+		"""
+		self.path = path
+		self.max_size = max_size
+		self.lock = Lock()
+		self.entries = OrderedDict() # key => size, oldest first
+		if not os.path.isdir(path):
+			os.mkdir(path)
+		# rebuild index from disk, using mtime as last access
+		files = []
+		for name in os.listdir(path):
+			key, ext = os.path.splitext(name)
+			if ext[1:] != CACHE_EXT:
+				continue
+			stat = os.stat(os.path.join(path, name))
+			files.append((stat.st_mtime, key, stat.st_size))
+		for _, key, size in sorted(files):
+			self.entries[key] = size
+		self.size = sum(self.entries.values())
+		log(f"Tile cache: {len(self.entries)} entries, {self.size/1024**2:.0f}MiB", "debug")
+
+	def get_key(self, image, settings):
+		"""
+		Get cache key for tile input image + settings used to process it
+		"""
+		h = hashlib.sha256()
+		h.update(str(tuple(image.shape)).encode())
+		h.update(memoryview(image.contiguous().numpy()).cast("B"))
+		# seed/prompt are part of the workflow (seed increment is applied before the job starts)
+		h.update(json.dumps(settings.get("workflow"), sort_keys=True).encode())
+		h.update(json.dumps({
+			"upscale_factor": settings.get("upscale_factor", 1.0),
+		}, sort_keys=True).encode())
+		return h.hexdigest()
+
+	def get_path(self, key):
+		return os.path.join(self.path, f"{key}.{CACHE_EXT}")
+
+	def get(self, key):
+		"""
+		Get cached tile as [B,C,H,W] float tensor, or None on miss
+		"""
+		with self.lock:
+			if key not in self.entries:
+				return None
+			self.entries.move_to_end(key)
+		path = self.get_path(key)
+		try:
+			os.utime(path) # mark as recently used
+			return sanitize(Image.open(path))
+		except Exception as e:
+			log(f"Tile cache: failed to load '{key}' ({e})", "warning")
+			with self.lock:
+				self.remove(key)
+			return None
+
+	def put(self, key, image):
+		"""
+		Store processed tile, then evict least recently used entries until under max size
+		"""
+		path = self.get_path(key)
+		# outputs are 8bit images to begin with, so this is lossless
+		to_pil_image(to_dtype(sanitize(image)[0], torch.uint8)).save(path)
+		with self.lock:
+			if key in self.entries:
+				self.size -= self.entries[key]
+			self.entries[key] = os.path.getsize(path)
+			self.entries.move_to_end(key)
+			self.size += self.entries[key]
+			while self.size > self.max_size and len(self.entries) > 1:
+				self.remove(next(iter(self.entries)))
+
+	def remove(self, key):
+		"""
+		Remove single entry. Caller must hold lock.
+		"""
+		self.size -= self.entries.pop(key, 0)
+		try:
+			os.remove(self.get_path(key))
+		except OSError:
+			pass
+
+tile_cache = None
+
+def init_tile_cache(path, max_size):
+	"""
+	Initialize global tile cache (on startup). max_size of 0 disables it.
+	"""
+	global tile_cache
+	tile_cache = TileCache(path, max_size) if max_size > 0 else None
+
+def get_tile_cache():
+	"""
+	Return global tile cache, None if disabled
+	"""
+	return tile_cache
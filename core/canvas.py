@@ -0,0 +1,156 @@
+#
+# Canvas (full size image) storage logic
+#
+import torch
+import weakref
+import tempfile
+import numpy as np
+import torchvision.transforms.functional as F
+
+from .utils import sanitize, channel_fix, to_dtype, get_canvas_dtype, log
+from .path import get_base_path
+from .resize import resize_to_canvas, estimate_resize_memory
+from .preview import get_preview_scale, PREVIEW_BAND
+
+CANVAS_BACKENDS = ["memory", "disk"]
+CANVAS_BAND = 256 # rows per band when copying to/from disk-backed canvases
+
+NUMPY_DTYPES = {
+	torch.float32: np.float32,
+	torch.float16: np.float16,
+	torch.uint8:   np.uint8,
+}
+
+DISK_CANVASES = weakref.WeakValueDictionary() # id => tensor, for disk-backed canvases
+
+def new_canvas(shape, dtype=torch.float32, backend="memory"):
+	"""
+	Create empty [B,C,H,W] canvas.
+	memory: regular tensor in RAM
+	disk: tensor backed by a memory-mapped temp file, only touched pages stay resident
+	"""
+	assert backend in CANVAS_BACKENDS, f"Invalid canvas backend '{backend}'!"
+	if backend == "memory":
+		return torch.zeros(tuple(shape), dtype=dtype)
+	# temp file is removed once the last reference to the mapping is gone
+	f = tempfile.TemporaryFile(dir=get_base_path("temp"), prefix="LiliumCanvas_")
+	arr = np.memmap(f, dtype=NUMPY_DTYPES[dtype], mode="w+", shape=tuple(shape))
+	arr.canvas_file = f # keep handle alive alongside the mapping
+	log(f"Created disk-backed canvas {tuple(shape)} [{dtype}]", "debug")
+	canvas = torch.from_numpy(arr)
+	DISK_CANVASES[id(canvas)] = canvas
+	return canvas
+
+def is_disk_canvas(t):
+	"""
+	Check if tensor is a (full, not a view of a) disk-backed canvas
+	"""
+	return DISK_CANVASES.get(id(t)) is t
+
+def copy_to_canvas(canvas, image, band=CANVAS_BAND):
+	"""
+	Copy image onto canvas in horizontal bands, converting dtype per band.
+	"""
+	for h in range(0, image.shape[2], band):
+		canvas[:, :, h:h+band].copy_(to_dtype(image[:, :, h:h+band], canvas.dtype))
+	return canvas
+
+def get_canvas(image, dtype=torch.float32, backend="memory", copy=False):
+	"""
+	Get image as a canvas with the requested storage dtype/backend.
+	copy: always return a new tensor, even if image already matches
+	"""
+	if backend == "memory":
+		canvas = to_dtype(image, dtype)
+		if copy and canvas is image:
+			canvas = canvas.clone()
+		return canvas
+	if not copy and image.dtype == dtype and is_disk_canvas(image):
+		return image
+	canvas = new_canvas(image.shape, dtype, backend)
+	return copy_to_canvas(canvas, image)
+
+def load_canvas(img, height, width, dtype=torch.float32, backend="memory", mode="bicubic"):
+	"""
+	Decode PIL image to a [1,3,H,W] canvas. Resized to height/width, then cropped to multiples of 8.
+	Decodes to uint8, resizing is done in bands straight into the canvas (see resize.py).
+	"""
+	if img.mode not in ["RGB", "RGBA", "L"]:
+		img = img.convert("RGB")
+	image = channel_fix(sanitize(F.pil_to_tensor(img)))
+	if tuple(image.shape[2:]) == (height, width):
+		image = image[:, :, :(height - height%8), :(width - width%8)]
+		return get_canvas(image, dtype, backend)
+	shape = (image.shape[0], image.shape[1], height - height%8, width - width%8)
+	canvas = new_canvas(shape, dtype, backend)
+	return resize_to_canvas(image, canvas, (height, width), mode)
+
+def estimate_job_memory(src_shape, shape, settings, workers=1, tile_size=1024):
+	"""
+	Project peak RAM use (bytes) for a tiled upscale job, from setup to assembly.
+	src_shape: [B,C,H,W] of the decoded input
+	shape: [B,C,H,W] of the final canvas
+	Returns breakdown of the largest allocations and the projected "peak".
+	"""
+	dtype = get_canvas_dtype(settings.get("canvas_dtype", "float32"))
+	resident = 0 if settings.get("canvas_backend", "memory") == "disk" else 1
+	esize = torch.empty((), dtype=dtype).element_size()
+	src_px = src_shape[0]*src_shape[1]*src_shape[2]*src_shape[3]
+	px = shape[0]*shape[1]*shape[2]*shape[3]
+	resized = tuple(src_shape[2:]) != tuple(shape[2:])
+
+	mem = {}
+	# decode (PIL + uint8 tensor) + temporaries of the banded input resize
+	mem["setup"] = src_px*2
+	if resized:
+		mem["setup"] += estimate_resize_memory(src_shape, shape[2:], settings.get("resize_mode", "bicubic"))
+	mem["canvas"] = px*esize*resident
+	mem["source"] = px*esize*resident if settings.get("tile_source", "raw") == "raw" else 0
+	factor = settings.get("upscale_factor", 1.0)
+	prepass = settings.get("prepass")
+	if mem["source"] and factor != 1.0 and not prepass:
+		mem["source"] += int(mem["source"] / (factor*factor)) # downscaled copy for tile inputs
+		mem["source"] += estimate_resize_memory(shape, (int(shape[2]/factor), int(shape[3]/factor)), "bilinear")
+	if prepass:
+		# output canvas (new tile source) + downscaled uint8 input, old source is alive until it's done
+		pf = prepass.get("upscale_factor", 1.0)
+		mem["prepass"] = px*esize*resident
+		if pf != 1.0:
+			mem["prepass"] += int(px / (pf*pf)) + estimate_resize_memory(shape, (int(shape[2]/pf), int(shape[3]/pf)))
+	else:
+		mem["prepass"] = 0
+	if settings.get("compositor", "mask") == "weighted":
+		mem["compositor"] = (px + px//shape[1])*4*resident
+	else:
+		mem["compositor"] = 0
+	# preview base + drawn preview + stored pyramid levels (uint8, 1/16+1/64+...), on disk with the disk backend
+	scale = get_preview_scale(shape[2])
+	preview_px = int(px*scale*scale)
+	mem["preview"] = (preview_px*2 + px//12)*resident
+	# banded build/redraw (full size rows gathered + float overlay copies), encoded image
+	mem["preview"] += PREVIEW_BAND*(px//shape[2])*4 + PREVIEW_BAND*int(px//shape[2]*scale)*4*3 + preview_px
+	# tile input/output/blend temp per worker
+	mem["tiles"] = workers*shape[0]*shape[1]*tile_size*tile_size*4*3
+
+	steady = mem["canvas"] + mem["source"] + mem["compositor"] + mem["preview"] + mem["tiles"] + mem["prepass"]
+	# decoded input is still alive while the canvas is built from it
+	handoff = mem["setup"] + mem["canvas"]
+	mem["peak"] = max(handoff, steady)
+	return mem
+
+def fit_memory_budget(src_shape, shape, settings, budget, **kwargs):
+	"""
+	Try to fit job into memory budget (bytes) by lowering canvas precision, then moving it to disk.
+	Returns updated settings or None if it can't fit.
+	"""
+	settings = settings.copy()
+	dtypes = ["float32", "float16", "uint8"]
+	current = dtypes.index(settings.get("canvas_dtype", "float32"))
+	backends = ["memory", "disk"]
+	for backend in backends[backends.index(settings.get("canvas_backend", "memory")):]:
+		for dtype in dtypes[current:]:
+			settings.update({"canvas_dtype": dtype, "canvas_backend": backend})
+			mem = estimate_job_memory(src_shape, shape, settings, **kwargs)
+			if mem["peak"] <= budget:
+				return settings
+	return None
@@ -0,0 +1,154 @@
+#
+# Compact worker capability index (nodes/models), cached on disk
+#
+import os
+import re
+import json
+import time
+import hashlib
+
+from .utils import log
+from .path import get_base_path
+from .workflow import NODES_WITH_PATH
+
+CAPABILITY_DIR = "workers" # inside temp folder
+CAPABILITY_REFRESH = 300 # seconds between background refreshes of the index
+
+# model list => (node class, input)
+MODEL_INPUTS = {
+	"checkpoint": ("CheckpointLoaderSimple", "ckpt_name"),
+	"loras": ("LoraLoader", "lora_name"),
+	"vae": ("VAELoader", "vae_name"),
+	"controlnet": ("ControlNetLoader", "control_net_name"),
+	"upscale_models": ("UpscaleModelLoader", "model_name"),
+}
+
+class AnySet(set):
+	"""
+	Set that contains everything, node/model index of fake (debug) workers
+	"""
+	def __contains__(self, item):
+		return True
+
+def normalize_names(names):
+	"""
+	Replace windows os.sep with linux version to allow comparison
+	"""
+	out = []
+	for name in names:
+		if "/" in name and "\\" in name:
+			log(f"Model name contains both `\\\\` and `/` '{name}'!", "warning")
+		out.append(name.replace('\\','/'))
+	return out
+
+def get_input_choices(object_info, node, key):
+	"""
+	Get list of valid values for a (required) list input of a node, empty if node is missing
+	"""
+	try:
+		return object_info[node]["input"]["required"][key][0]
+	except (KeyError, IndexError, TypeError):
+		return []
+
+def build_capabilities(object_info):
+	"""
+	Build compact index from the (large) object_info response of a worker.
+	nodes: available node classes
+	models: model lists, same format as before
+	paths: NODES_WITH_PATH node class => valid values for the path input
+	"""
+	caps = {
+		"nodes": sorted(object_info.keys()),
+		"models": {k:normalize_names(get_input_choices(object_info, *v)) for k,v in MODEL_INPUTS.items()},
+		"paths": {k:normalize_names(get_input_choices(object_info, k, v)) for k,v in NODES_WITH_PATH.items()},
+	}
+	caps["hash"] = get_capability_hash(caps)
+	caps["updated"] = time.time()
+	return caps
+
+def get_capability_hash(caps):
+	"""
+	Hash of the index contents, used to detect changes on the worker
+	"""
+	data = {k:caps[k] for k in ["nodes", "models", "paths"]}
+	return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+def get_capability_path(worker_id):
+	path = os.path.join(get_base_path("temp"), CAPABILITY_DIR)
+	if not os.path.isdir(path):
+		os.mkdir(path)
+	return os.path.join(path, re.sub(r"[^\w.-]", "_", worker_id) + ".json")
+
+def save_capabilities(worker_id, caps):
+	"""
+	Store index for worker on disk (atomic)
+	"""
+	path = get_capability_path(worker_id)
+	with open(f"{path}.tmp", "w", encoding="UTF-8") as f:
+		json.dump(caps, f)
+	os.replace(f"{path}.tmp", path)
+
+def load_capabilities(worker_id):
+	"""
+	Load stored index for worker, None if missing/invalid
+	"""
+	path = get_capability_path(worker_id)
+	if not os.path.isfile(path):
+		return None
+	try:
+		with open(path, encoding="UTF-8") as f:
+			caps = json.load(f)
+		assert caps.get("hash") == get_capability_hash(caps), "Hash mismatch"
+		return caps
+	except Exception as e:
+		log(f"Ignoring invalid capability cache for {worker_id} ({e})", "warning")
+		return None
+
+def get_missing_capabilities(wf, worker):
+	"""
+	Check workflow against the worker index, one set lookup per node.
+	Returns list of reasons the worker can't run it, empty if it can.
+	"""
+	nodes = getattr(worker, "nodes", None)
+	if nodes is None:
+		return ["no node/model info"]
+	reasons = []
+	for node in wf.values():
+		cls = node.get("class_type")
+		if cls not in nodes:
+			reasons.append(f"missing node '{cls}'")
+			continue
+		# model/LoRA/etc, only if it's set directly (not linked from another node)
+		key = NODES_WITH_PATH.get(cls)
+		value = node.get("inputs", {}).get(key) if key else None
+		if isinstance(value, str) and value not in worker.paths.get(cls, set()):
+			reasons.append(f"missing model '{value}' ({cls})")
+	return list(dict.fromkeys(reasons))
+
+def get_eligible_workers(wf, workers):
+	"""
+	Split workers into the ones that can run the workflow and the excluded ones.
+	Returns (eligible, excluded) with excluded as worker_id => {name, reasons}
+	"""
+	eligible = []
+	excluded = {}
+	for worker in workers:
+		reasons = get_missing_capabilities(wf, worker)
+		if reasons:
+			excluded[worker.worker_id] = {"name": worker.name, "reasons": reasons}
+		else:
+			eligible.append(worker)
+	return eligible, excluded
+
+def verify_workflow(wf, workers):
+	"""
+	Verify that at least one worker has all nodes/models the workflow needs.
+	Returns excluded workers (see get_eligible_workers), raises ValueError if none are left.
+	"""
+	eligible, excluded = get_eligible_workers(wf, workers)
+	for worker_id, info in excluded.items():
+		log(f"Worker {worker_id} [{info['name']}] can't run workflow: {', '.join(info['reasons'])}", "warning")
+	if workers and not eligible:
+		reasons = sorted(set(sum([x["reasons"] for x in excluded.values()], [])))
+		raise ValueError(f"No worker can run this workflow! ({', '.join(reasons)})")
+	return excluded
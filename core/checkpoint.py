@@ -0,0 +1,219 @@
+#
+# Job checkpointing / resume logic
+#
+import os
+import json
+import time
+import torch
+import shutil
+from threading import Lock
+
+from .utils import to_dtype, log
+from .path import get_base_path
+
+CHECKPOINT_DIR = "checkpoints" # inside temp folder
+STATE_FILE = "state.json"
+REQUEST_FILE = "request.json"
+TILE_FILE = "tiles.bin"
+CHECKPOINT_MAX_AGE = 7*24*3600 # seconds, older checkpoints are deleted when a new one is created
+CHECKPOINT_MAX_MB = 16384 # total size, oldest checkpoints are deleted first
+
+def get_checkpoint_dir():
+	"""
+	Get (and create) folder that holds all checkpoints
+	"""
+	path = os.path.join(get_base_path("temp"), CHECKPOINT_DIR)
+	if not os.path.isdir(path):
+		os.mkdir(path)
+	return path
+
+def get_slicer_geometry(slicer):
+	"""
+	List of [h,w,h_start,h_end,w_start,w_end] for all tiles, used to verify resumes
+	"""
+	return [[x.h, x.w, x.h_start, x.h_end, x.w_start, x.w_end] for x in slicer.tiles]
+
+class JobCheckpoint:
+	"""
+	Incremental checkpoint for a single job.
+	Finished tiles are appended to a tile-indexed binary file, the state is a small json.
+	"""
+	def __init__(self, name, request=None):
+		"""
+		name: checkpoint name (folder in temp/checkpoints)
+		request: original start request, required to rebuild the job on resume
+		"""
+		self.name = name
+		self.path = os.path.join(get_checkpoint_dir(), name)
+		self.lock = Lock()
+		state_path = os.path.join(self.path, STATE_FILE)
+		if os.path.isfile(state_path):
+			with open(state_path, encoding="UTF-8") as f:
+				self.state = json.load(f)
+		else:
+			os.makedirs(self.path, exist_ok=True)
+			# request (incl. workflow) is only written once, state is rewritten per tile
+			with open(os.path.join(self.path, REQUEST_FILE), "w", encoding="UTF-8") as f:
+				json.dump(request, f)
+			self.state = {
+				"created": time.time(),
+				"geometry": None,
+				"shape": None, # [H,W] of the output canvas
+				"upscale_factor": None,
+				"tiles": {},  # "h,w" => {offset, shape}
+				"order": [],  # assembly order, required for ordered mask blending
+			}
+
+	def get_request(self):
+		"""
+		Get original start request for the job
+		"""
+		with open(os.path.join(self.path, REQUEST_FILE), encoding="UTF-8") as f:
+			return json.load(f)
+
+	def save_state(self):
+		"""
+		Write state to disk atomically. Caller must hold lock.
+		"""
+		tmp = os.path.join(self.path, f"{STATE_FILE}.tmp")
+		with open(tmp, "w", encoding="UTF-8") as f:
+			json.dump(self.state, f)
+		os.replace(tmp, os.path.join(self.path, STATE_FILE))
+
+	def verify(self, shape=None, upscale_factor=None, slicer=None):
+		"""
+		Check job parameters against the stored ones (if any). Raises ValueError on mismatch.
+		shape: [B,C,H,W] output canvas shape
+		upscale_factor: workflow upscale factor
+		slicer: slicer with tiles built, checks tile size/overlap/placement
+		"""
+		with self.lock:
+			if self.state["geometry"] is None:
+				return
+			stored = self.state.get("shape")
+			if shape is not None and stored is not None and list(shape[2:]) != stored:
+				raise ValueError(f"Checkpoint image size {stored} doesn't match job {list(shape[2:])}!")
+			stored = self.state.get("upscale_factor")
+			if upscale_factor is not None and stored is not None and upscale_factor != stored:
+				raise ValueError(f"Checkpoint upscale factor {stored} doesn't match job {upscale_factor}!")
+			if slicer is not None and self.state["geometry"] != get_slicer_geometry(slicer):
+				raise ValueError("Checkpoint tile geometry doesn't match job!")
+
+	def start(self, slicer, shape, upscale_factor=1.0):
+		"""
+		Store job geometry, or verify it against the stored one when resuming. Raises ValueError on mismatch.
+		"""
+		self.verify(shape, upscale_factor, slicer)
+		with self.lock:
+			if self.state["geometry"] is None:
+				self.state["geometry"] = get_slicer_geometry(slicer)
+				self.state["shape"] = list(shape[2:])
+				self.state["upscale_factor"] = upscale_factor
+				self.save_state()
+
+	def add_tile(self, tile, image):
+		"""
+		Append finished tile (as uint8) to the tile file and mark it as done
+		"""
+		data = to_dtype(image, torch.uint8).contiguous()
+		key = f"{tile.h},{tile.w}"
+		with self.lock:
+			with open(os.path.join(self.path, TILE_FILE), "ab") as f:
+				offset = f.tell()
+				f.write(memoryview(data.numpy()).cast("B"))
+			self.state["tiles"][key] = {"offset": offset, "shape": list(data.shape)}
+			self.state["order"].append(key)
+			self.save_state()
+
+	def get_tiles(self, slicer):
+		"""
+		Iterate (tile, float image) pairs for all finished tiles, in assembly order
+		"""
+		path = os.path.join(self.path, TILE_FILE)
+		for key in self.state["order"]:
+			info = self.state["tiles"][key]
+			tile = slicer.get_tile_at(*[int(x) for x in key.split(",")])
+			count = 1
+			for x in info["shape"]:
+				count *= x
+			with open(path, "rb") as f:
+				f.seek(info["offset"])
+				raw = bytearray(f.read(count))
+			image = torch.frombuffer(raw, dtype=torch.uint8).reshape(info["shape"])
+			yield tile, to_dtype(image, torch.float32)
+
+	def remove(self):
+		"""
+		Delete checkpoint from disk (job finished)
+		"""
+		shutil.rmtree(self.path, ignore_errors=True)
+
+	def get_info(self):
+		return {
+			"name": self.name,
+			"created": self.state["created"],
+			"done": len(self.state["order"]),
+			"total": len(self.state["geometry"] or []),
+			"size": round(get_checkpoint_size(self.path)/1024**2, 1), # MiB
+		}
+
+def new_checkpoint(request):
+	"""
+	Create checkpoint for a new job
+	"""
+	cleanup_checkpoints()
+	name = f"job-{int(time.time()*1000)}"
+	return JobCheckpoint(name, request)
+
+def get_checkpoint_size(path):
+	return sum(os.path.getsize(os.path.join(path, x)) for x in os.listdir(path))
+
+def cleanup_checkpoints(max_age=CHECKPOINT_MAX_AGE, max_mb=CHECKPOINT_MAX_MB):
+	"""
+	Delete checkpoints that weren't updated for max_age seconds, then the oldest ones until under max_mb
+	"""
+	base = get_checkpoint_dir()
+	found = [] # (last update, name, size)
+	for name in os.listdir(base):
+		path = os.path.join(base, name)
+		if not os.path.isdir(path):
+			continue
+		state = os.path.join(path, STATE_FILE)
+		updated = os.path.getmtime(state if os.path.isfile(state) else path)
+		found.append((updated, name, get_checkpoint_size(path)))
+	total = sum(x[2] for x in found)
+	for updated, name, size in sorted(found):
+		if time.time() - updated < max_age and total <= max_mb*1024**2:
+			break
+		log(f"Removing old checkpoint '{name}' ({size/1024**2:.0f}MiB)", "info")
+		shutil.rmtree(os.path.join(base, name), ignore_errors=True)
+		total -= size
+
+def list_checkpoints():
+	"""
+	Get info about all resumable checkpoints, newest first
+	"""
+	out = []
+	base = get_checkpoint_dir()
+	for name in os.listdir(base):
+		if not os.path.isfile(os.path.join(base, name, STATE_FILE)):
+			continue
+		try:
+			out.append(JobCheckpoint(name).get_info())
+		except Exception as e:
+			log(f"Failed to load checkpoint '{name}' ({e})", "warning")
+	return sorted(out, key=lambda x: x["created"], reverse=True)
+
+def load_checkpoint(name):
+	"""
+	Load existing checkpoint by name. Raises FileNotFoundError if missing.
+	"""
+	if os.path.basename(name) != name or not os.path.isfile(os.path.join(get_checkpoint_dir(), name, STATE_FILE)):
+		raise FileNotFoundError(f"Checkpoint not found '{name}'")
+	return JobCheckpoint(name)
+
+def delete_checkpoint(name):
+	"""
+	Delete existing checkpoint by name. Raises FileNotFoundError if missing.
+	"""
+	load_checkpoint(name).remove()
@@ -0,0 +1,78 @@
+#
+# Alternative tile compositing logic
+#
+import torch
+import torchvision.transforms.functional as F
+from threading import Lock
+
+from .utils import sanitize, from_float
+from .mask import get_weight_mask, get_tile_edges
+from .canvas import new_canvas, CANVAS_BAND
+
+class WeightedCompositor:
+	"""
+	Order-independent compositing using a weight-sum and weighted-color accumulator.
+	Tiles can be added in any order, the result only depends on the set of tiles.
+	"""
+	def __init__(self, image, backend="memory"):
+		"""
+		image: full image that the output will be written to
+		backend: canvas backend for the accumulators
+		"""
+		self.image = sanitize(image)
+		self.color = new_canvas(self.image.shape, torch.float32, backend)
+		self.weight = new_canvas(
+			(self.image.shape[0], 1, self.image.shape[2], self.image.shape[3]),
+			torch.float32, backend,
+		)
+		self.lock = Lock()
+
+	def put(self, tile, tile_image):
+		"""
+		Accumulate finished tile, then write the normalized region back to the image.
+		! overlapping tiles must not be added concurrently
+		"""
+		tile_image = sanitize(tile_image).to(torch.float32)
+		# worker output can be off by a few pixels, match the tile window (same as Tile.put)
+		size = (tile.h_end-tile.h_start, tile.w_end-tile.w_start)
+		if tuple(tile_image.shape[2:]) != size:
+			tile_image = F.resize(tile_image, size, antialias=True)
+		weight = get_weight_mask(tile_image.shape, get_tile_edges(tile))
+		region = (
+			slice(None), slice(None),
+			slice(tile.h_start, tile.h_end),
+			slice(tile.w_start, tile.w_end),
+		)
+		# no lock, the assembler never puts overlapping tiles at the same time
+		self.color[region].addcmul_(tile_image, weight)
+		self.weight[region].add_(weight)
+		# every pixel in the region has a non-zero weight at this point
+		self.image[region] = from_float(self.color[region] / self.weight[region], self.image.dtype)
+		return self.image
+
+	def normalize(self):
+		"""
+		Get final image. Pixels not covered by any tile keep their original value.
+		"""
+		with self.lock:
+			# in bands to keep temporaries small (accumulators might be on disk)
+			for h in range(0, self.image.shape[2], CANVAS_BAND):
+				band = (slice(None), slice(None), slice(h, h+CANVAS_BAND))
+				covered = (self.weight[band] > 0.0).expand_as(self.image[band])
+				out = from_float(self.color[band] / torch.clamp(self.weight[band], min=1e-8), self.image.dtype)
+				self.image[band][covered] = out[covered]
+		return self.image
+
+# List of all available compositing modes (None is the default mask blend)
+COMPOSITOR_DICT = {
+	"mask": None,
+	"weighted": WeightedCompositor,
+}
+
+def get_compositor(name, image, backend="memory"):
+	"""
+	Return initialized compositor from name, or None for the default mask blend.
+	"""
+	assert name in COMPOSITOR_DICT,f"Invalid compositor type '{name}'!"
+	compositor_class = COMPOSITOR_DICT[name]
+	return compositor_class(image, backend) if compositor_class else None
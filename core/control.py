@@ -5,16 +5,114 @@ import time
 import torch
 import traceback
 from tqdm import tqdm
-from queue import Queue
+from queue import Queue, Empty
 from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-from .utils import sanitize, log
+from .utils import sanitize, log, get_canvas_dtype, get_peak_rss, get_current_rss, to_float
+from .canvas import get_canvas, new_canvas
+from .resize import resize_to_canvas
 from .save import save_output_image
 from .mask import MaskBuilder, fix_mask_edge
+from .composite import get_compositor
+from .region import select_region_tiles
 from .preview import TiledUpscalePreviewer, TiledUpscaleDebugPreviewer
+from .workflow import get_warmup_workflow, WorkflowTemplate
+from .prepass import PrePass, PREPASS_CHUNK
+from .pyramid import TilePyramid
+
+ASSEMBLY_THREADS = 4 # max. tiles assembled at once (only if they don't overlap)
+WARMUP_SIZE = 64 # input/latent size for warm-up runs
+RESULT_QUEUE_TILES = 8 # max. finished tiles waiting for assembly before dispatch is paused
+RESULT_QUEUE_MB = 0 # same but total size, 0 = no limit
+
+class ResultQueue(Queue):
+	"""
+	Queue for finished (tile, tile_image) pairs, tracking how many tiles/bytes are held.
+	Items count as held until done() is called, not just until they're taken off the queue.
+	Never blocks on put (worker results can't be dropped), dispatch checks is_saturated() instead.
+	"""
+	def __init__(self, max_tiles=RESULT_QUEUE_TILES, max_bytes=0):
+		"""
+		max_tiles: held tiles before saturating, 0 = no limit
+		max_bytes: held bytes before saturating, 0 = no limit
+		"""
+		super().__init__()
+		self.max_tiles = max_tiles
+		self.max_bytes = max_bytes
+		self.held = 0
+		self.bytes = 0
+		self.peak_held = 0
+		self.peak_bytes = 0
+		self.wait_total = 0.0 # time spent in queue (put => get)
+		self.wait_max = 0.0
+		self.wait_count = 0
+		self.stall_time = 0.0 # time dispatch was paused for
+
+	# Queue internals, these are called with the queue mutex held
+	def _put(self, item):
+		self.held += 1
+		self.bytes += item[1].nbytes
+		self.peak_held = max(self.peak_held, self.held)
+		self.peak_bytes = max(self.peak_bytes, self.bytes)
+		self.queue.append((time.time(), item))
+
+	def _get(self):
+		added, item = self.queue.popleft()
+		waited = time.time() - added
+		self.wait_total += waited
+		self.wait_max = max(self.wait_max, waited)
+		self.wait_count += 1
+		return item
+
+	def done(self, item):
+		"""
+		Release item (tile assembled), replaces task_done()
+		"""
+		with self.mutex:
+			self.held -= 1
+			self.bytes -= item[1].nbytes
+		self.task_done()
+
+	def is_saturated(self):
+		"""
+		Check if too many finished tiles are waiting, i.e. no new tiles should be dispatched
+		"""
+		with self.mutex:
+			return (
+				(self.max_tiles > 0 and self.held >= self.max_tiles) or
+				(self.max_bytes > 0 and self.bytes >= self.max_bytes)
+			)
+
+	def wait_free(self, interval=0.15):
+		"""
+		Block until queue isn't saturated anymore, counted as stall time
+		"""
+		start = time.time()
+		while self.is_saturated():
+			time.sleep(interval)
+		with self.mutex:
+			self.stall_time += time.time() - start
+
+	def get_info(self):
+		"""
+		Get queue depth/size/wait stats
+		"""
+		with self.mutex:
+			return {
+				"depth": self.held,
+				"depth_peak": self.peak_held,
+				"depth_max": self.max_tiles,
+				"mb": round(self.bytes/1024**2, 1),
+				"mb_peak": round(self.peak_bytes/1024**2, 1),
+				"mb_max": round(self.max_bytes/1024**2, 1),
+				"wait_avg": round(self.wait_total/max(self.wait_count, 1), 3),
+				"wait_max": round(self.wait_max, 3),
+				"stall": round(self.stall_time, 1),
+			}
 
 class TiledUpscaleJob:
-	def __init__(self, slicer, image, mask, workers, settings={}, preview=True, save=True):
+	def __init__(self, slicer, image, mask, workers, settings={}, preview=True, save=True, cache=None, source=None, region=None, checkpoint=None, prepass=None):
 		"""
 		Iterate all tiles using the provided processing function.
 		slicer: pre-initialized slicer object
@@ -23,18 +121,48 @@ class TiledUpscaleJob:
 		workers: list of workers to dispatch jobs to
 		settings: dict passed to worker for processing
 		save: save final output to disk
+		cache: TileCache to reuse processed tiles from (optional)
+		source: separate raw tile source, if image isn't the input (e.g. partial re-render)
+		region: RegionMask, only tiles touching it are processed & blended onto image
+		checkpoint: JobCheckpoint to store finished tiles in/resume from (optional)
+		prepass: dict with workflow/upscale_factor/chunk_size/workers for a global pre-pass (optional)
 		"""
 		self.slicer = slicer
-		self.image = sanitize(image)
+		self.region = region
+		if self.region:
+			select_region_tiles(self.slicer, self.region)
+		# canvas storage can be reduced precision and/or on disk, blending is always done in float
+		self.canvas_dtype = get_canvas_dtype(settings.get("canvas_dtype", "float32"))
+		self.canvas_backend = settings.get("canvas_backend", "memory")
+		self.image = get_canvas(sanitize(image), self.canvas_dtype, self.canvas_backend)
 		self.mask = mask # MaskBuilder instance or tensor, so no sanitize
 		self.workers = workers
 
 		self.lock = Lock()
-		self.pbar = tqdm(total=len(self.slicer.tiles), unit="tile")
+		self.pbar = tqdm(total=len([x for x in self.slicer.tiles if not x.done]), unit="tile")
 
 		self.save = save
+		self.error = None # reason the job failed, if it did
 		self.output = None # final image
 		self.outputs = None # same but saved to disk
+		self.memory = {} # projected memory use, see estimate_job_memory
+		self.excluded = {} # workers that can't run the workflow, see get_eligible_workers
+
+		self.cache = cache
+		self.cache_hits = 0
+		self.cache_misses = 0
+
+		self.checkpoint = checkpoint
+		self.restored = set() # tiles loaded from checkpoint, not re-added to it
+		self.aborted = False
+		self.peak_rss = get_peak_rss() # process lifetime
+		self.rss_start = get_current_rss() # baseline for this job
+		self.rss_peak = self.rss_start # sampled while the job runs
+		self.assembly_count = 0
+		self.assembly_time = 0.0 # total time spent assembling tiles (all threads)
+		self.events = None # EventBroadcaster to push status/tile/preview events to (optional)
+		self.warmup_times = {} # worker name => seconds, see warmup
+		self.warming = set() # workers reserved for warm-up, not dispatched to until done
 
 		# Not always used/required.
 		self.settings = settings.copy()
@@ -47,38 +175,109 @@ class TiledUpscaleJob:
 			})
 
 		tile_src = settings.get("tile_source", "raw")
-		if tile_src == "raw":
-			self.source = image.clone()
+		if tile_src == "raw" and source is not None:
+			self.source = get_canvas(sanitize(source), self.canvas_dtype, self.canvas_backend)
+		elif tile_src == "raw":
+			self.source = get_canvas(self.image, self.canvas_dtype, self.canvas_backend, copy=True)
 		elif tile_src == "out":
-			self.source = image
+			self.source = self.image
 		else:
 			raise ValueError(f"Unknown tile/image source '{tile_src}'! [raw|out]")
 
+		# global pre-pass over the tile source, run before any tiles are dispatched
+		self.prepass = None
+		if prepass:
+			self.prepass = PrePass(
+				image = self.source,
+				workers = prepass["workers"],
+				workflow = prepass["workflow"],
+				upscale_factor = prepass.get("upscale_factor", 1.0),
+				chunk_size = prepass.get("chunk_size", PREPASS_CHUNK),
+			)
+
+		# tile source downscaled by the workflow upscale factor, built once at the start
+		self.scaled_source = None
+
+		# workflow node lookups/path formatting done once instead of per tile
+		self.template = WorkflowTemplate(settings["workflow"]) if "workflow" in settings else None
+
+		# alternative compositing (order-independent) - default is mask blending
+		self.compositor = get_compositor(settings.get("compositor", "mask"), self.image, self.canvas_backend)
+
 		# debug preview only works locally.
 		if preview == "debug":
-			self.previewer = TiledUpscaleDebugPreviewer(self.slicer, image.clone())
+			self.previewer = TiledUpscaleDebugPreviewer(self.slicer, self.image, backend=self.canvas_backend)
 		elif preview:
-			self.previewer = TiledUpscalePreviewer(self.slicer, image.clone())
+			self.previewer = TiledUpscalePreviewer(self.slicer, self.image, backend=self.canvas_backend)
 		else:
 			self.previewer = None
+		if self.previewer:
+			self.previewer.on_change = lambda changed: self.emit("preview", {"changed": int(changed)})
+		# deep zoom view of the full size output, built on first request
+		self.pyramid = TilePyramid(self.image, backend=self.canvas_backend) if self.previewer else None
 
 	def run(self):
 		"""
-		Run job to completion. Blocking.
+		Run job to completion. Blocking. Always ends finished or aborted, never stuck in processing.
+		"""
+		try:
+			self.run_tiles()
+		except Exception as e:
+			log(f"Job failed! ({e})", "error")
+			log(f"Job traceback:\n{traceback.format_exc()}", "debug")
+			self.error = str(e)
+			if not self.aborted:
+				self.abort()
+			self.cleanup()
+
+	def run_tiles(self):
+		"""
+		Process all tiles and save the output. Blocking.
 		"""
+		self.emit("status")
 		# set up queue for format (tile[Tile], tile_out[Tensor]) + start thread
-		self.queue = Queue()
+		self.queue = ResultQueue(
+			max_tiles = self.settings.get("result_queue_tiles", RESULT_QUEUE_TILES),
+			max_bytes = int(self.settings.get("result_queue_mb", RESULT_QUEUE_MB) * 1024**2),
+		)
 		self.assembler = Thread(target=self.assemble, daemon=True)
 		self.assembler.start()
 
+		# before replay, restored tiles must not be cropped from/blended with the old source
+		if self.prepass:
+			self.run_prepass()
+			if self.aborted:
+				self.cleanup()
+				return
+		self.scaled_source = self.get_scaled_source()
+
+		# resume - replay finished tiles from checkpoint through the assembler, in order
+		if self.checkpoint:
+			# geometry is stored/verified by the server before the job is started
+			for tile, tile_image in self.checkpoint.get_tiles(self.slicer):
+				self.queue.wait_free()
+				with self.lock:
+					tile.proc = True
+					self.restored.add(tile)
+				self.queue.put((tile, tile_image))
+			if self.restored:
+				log(f"Resuming job, {len(self.restored)} tiles restored from checkpoint", "info")
+
+		warmup = self.settings.get("warmup", False) and "workflow" in self.settings
 		while not self.slicer.done():
+			# backpressure - don't send out new tiles while assembly is behind
+			if self.queue.is_saturated():
+				self.queue.wait_free()
+				continue
 			# get tiles available for processing
 			to_proc = self.slicer.get_tiles()
 			if len(to_proc) == 0:
 				time.sleep(0.3)
 				continue
 			# get free workers
-			available = sorted([x for x in self.workers if x.state == "idle"])
+			with self.lock:
+				available = sorted([x for x in self.workers if x.state == "idle" and x not in self.warming])
+			dispatched = False
 			for tile in to_proc:
 				if len(available) == 0:
 					time.sleep(0.3)
@@ -89,31 +288,65 @@ class TiledUpscaleJob:
 					log(f"Dispatching tile {tile} to worker {worker}", "info")
 					tile.proc = True
 					tile.worker = worker
+				self.emit("tile", {"h": tile.h, "w": tile.w, "state": "start", "worker": worker.name})
+				dispatched = True
 				# dispatch worker
 				Thread(
 					target = self.process,
 					args   = (tile, worker),
 					daemon = True
 				).start()
+			# load models on workers that didn't get a tile in the first round (e.g. NyanTile)
+			if warmup and dispatched:
+				warmup = False
+				# only ones left over, workers that just got a tile are still "idle" until their thread starts
+				for worker in available:
+					# reserve now, the worker is only marked busy once the thread is in process()
+					with self.lock:
+						self.warming.add(worker)
+					Thread(target=self.warmup, args=(worker,), daemon=True).start()
 			time.sleep(0.15) # just to be safe
-			# mark change on previewer
-			if self.previewer:
+			self.sample_rss()
+			# mark change on previewer (new tiles in overlay)
+			if self.previewer and dispatched:
 				self.previewer.mark_change()
-		# wait for assembler
-		self.queue.join()
+		# wait for assembler (it releases everything it didn't assemble on abort)
 		self.assembler.join()
+		if not self.aborted:
+			self.queue.join()
 		# save output if required
+		if self.compositor:
+			self.image = self.compositor.normalize()
+			if self.pyramid:
+				self.pyramid.mark_dirty()
 		self.output = self.image
 		if self.save:
-			self.outputs = save_output_image(self.output, meta=self.settings)
+			self.outputs = save_output_image(
+				self.output,
+				meta   = self.settings,
+				stream = (self.canvas_backend == "disk"),
+			)
+		self.peak_rss = get_peak_rss()
+		self.sample_rss()
+		# finished, checkpoint no longer needed (kept on abort for resuming)
+		if self.checkpoint and not self.aborted:
+			self.checkpoint.remove()
+		self.cleanup()
+
+	def cleanup(self):
+		"""
+		Stop previewer, reset workers, free tiles. Runs once the job is finished/failed.
+		"""
 		# update final preview
 		if self.previewer:
+			self.previewer.stop()
 			self.previewer.mark_change()
 		#cleanup
 		self.pbar.close()
 		time.sleep(0.3)
 		[x.reset() for x in self.workers]
 		self.slicer.tiles = [] # free up RAM & speed up .done()
+		self.emit("status")
 
 	def start(self):
 		"""
@@ -122,12 +355,93 @@ class TiledUpscaleJob:
 		self.runner = Thread(target=self.run, daemon=True)
 		self.runner.start()
 
+	def run_prepass(self):
+		"""
+		Replace tile source with the pre-pass output, the output canvas is left as-is. Aborts the job on failure.
+		"""
+		try:
+			output = self.prepass.run(self.canvas_dtype, self.canvas_backend)
+		except Exception as e:
+			log(f"Pre-pass failed, aborting job ({e})", "error")
+			self.error = f"Pre-pass failed ({e})"
+			self.abort()
+			return
+		# never written to the output, that would overwrite restored tiles on resume and the
+		# base image outside of the region on re-renders (tile_source=out is rejected by the server)
+		self.source = output
+		# tile inputs are already at the final resolution now
+		self.settings["upscale_factor"] = 1.0
+		self.emit("status")
+
+	def get_scaled_source(self):
+		"""
+		Downscale the whole tile source by the upscale factor (banded, threaded) so tiles can be
+		cropped from it instead of every worker resampling its own tile. None if not needed.
+		"""
+		factor = self.settings.get("upscale_factor", 1.0)
+		if factor == 1.0 or self.source is self.image or self.aborted:
+			# output as tile source changes while tiles are assembled, worker has to scale per tile
+			return None
+		start = time.time()
+		size = (max(round(self.source.shape[2] / factor), 1), max(round(self.source.shape[3] / factor), 1))
+		scaled = new_canvas((*self.source.shape[:2], *size), self.canvas_dtype, self.canvas_backend)
+		scaled = resize_to_canvas(self.source, scaled, size, mode="bilinear")
+		log(f"Downscaled tile source to {size[1]}x{size[0]} in {time.time()-start:.2f}s", "debug")
+		return scaled
+
+	def warmup(self, worker):
+		"""
+		Run cheap version of the workflow so the worker has all models loaded by the time it gets a tile.
+		Separate thread, worker is busy until done.
+		"""
+		start = time.time()
+		settings = self.settings.copy()
+		settings.update({
+			"workflow": get_warmup_workflow(self.settings["workflow"], WARMUP_SIZE),
+			"upscale_factor": 1.0,
+		})
+		image = self.source[:, :, :WARMUP_SIZE, :WARMUP_SIZE]
+		log(f"Warming up worker {worker}", "debug")
+		try:
+			worker.process(to_float(image, copy=True), settings)
+		except Exception as e:
+			log(f"Warm-up failed on worker {worker} ({e})", "warning")
+			return
+		finally:
+			with self.lock:
+				self.warming.discard(worker)
+		with self.lock:
+			self.warmup_times[worker.name] = round(time.time() - start, 2)
+		log(f"Worker {worker} warmed up in {time.time()-start:.2f}s", "info")
+
 	def process(self, tile, worker):
 		"""
 		Process a single tile, add tile to queue when ready. Separate thread.
 		"""
 		# get actual image that'll be processed
-		image = tile.get(self.source)
+		if self.scaled_source is not None:
+			# actual per-axis scale, the scaled size is rounded
+			scale = (
+				self.scaled_source.shape[2] / self.source.shape[2],
+				self.scaled_source.shape[3] / self.source.shape[3],
+			)
+			image = tile.get(self.scaled_source, scale)
+		else:
+			image = tile.get(self.source)
+
+		# reuse previous result if the exact same tile was processed before
+		if self.cache:
+			key = self.cache.get_key(image, self.settings)
+			out = self.cache.get(key)
+			with self.lock:
+				if out is not None:
+					self.cache_hits += 1
+				else:
+					self.cache_misses += 1
+			if out is not None:
+				log(f"Tile {tile} loaded from cache", "info")
+				self.queue.put((tile, out))
+				return
 
 		# Not sure which one of these is useful, better include all.
 		# (can't pass the entire tile since worker.process() is generic)
@@ -142,7 +456,10 @@ class TiledUpscaleJob:
 			"tile_w_end": tile.w_end,
 			"tile_width": tile.w_end-tile.w_start,
 			"tile_height": tile.h_end-tile.h_start,
+			"workflow_template": self.template,
 		})
+		if self.scaled_source is not None:
+			settings["upscale_factor"] = 1.0 # already cropped from the downscaled source
 
 		try:
 			out = worker.process(image, settings)
@@ -150,48 +467,122 @@ class TiledUpscaleJob:
 			log(f"Tile {tile} failed! ({e})", "error")
 			log(f"Tile {tile} traceback:\n{traceback.format_exc()}", "debug")
 			tile.proc = False
+			self.emit("tile", {"h": tile.h, "w": tile.w, "state": "failed", "worker": worker.name})
+			if self.previewer:
+				self.previewer.mark_change()
 		else:
+			if self.aborted:
+				log(f"Tile {tile} finished after abort, dropped", "debug")
+				return
 			self.queue.put((tile, out))
+			if self.cache:
+				try:
+					self.cache.put(key, out)
+				except Exception as e:
+					log(f"Failed to cache tile {tile} ({e})", "warning")
 
 	def assemble(self):
 		"""
 		Receive tiles and paste them onto the output.
 		"""
-		# define function to prepare mask
+		# define function to prepare mask (tile, shape, size) - builder masks are cached
 		if torch.is_tensor(self.mask):
-			get_mask = lambda shape: self.mask.clone()
+			get_tile_mask = lambda tile, shape, size=None: fix_mask_edge(self.mask.clone(), tile)
 		elif type(self.mask) == MaskBuilder:
-			get_mask = self.mask.from_shape
+			get_tile_mask = lambda tile, shape, size=None: self.mask.from_shape(shape, tile=tile, size=size)
 		else:
 			raise ValueError("Mask must be one of [Mask,Tensor]!")
 
-		while not self.slicer.done():
-			# get finished tile and paste onto output image
-			tile, tile_image = self.queue.get() # FIFO, blocking
-			tile_mask = get_mask(tile_image.shape)
-			tile_mask = fix_mask_edge(tile_mask, tile)
-			self.image = tile.put(self.image, tile_image, tile_mask)
-			# mark tile as done
-			with self.lock:
-				tile.done = True
-				tile.worker = None
-				tile.proc = False
-			# apply change to previewer
-			if self.previewer:
-				self.previewer.image = tile.put(
-					image = self.previewer.image,
-					scale = self.previewer.scale,
-					mask  = tile_mask,
-					tile  = torch.nn.functional.interpolate(
-						tile_image,
-						scale_factor = self.previewer.scale,
-						mode = "nearest",
-					)
-				)
-				self.previewer.mark_change()
-			# end queue job
-			self.queue.task_done()
-			self.pbar.update()
+		# limit blending to the region of interest (partial re-render)
+		if self.region:
+			def get_mask(tile, shape, size=None):
+				mask = get_tile_mask(tile, shape, size)
+				return mask * self.region.get(tile, mask.shape[2:])
+		else:
+			get_mask = get_tile_mask
+
+		# tiles with overlapping write regions are assembled in arrival order, others in parallel
+		pending = [] # (tile, tile_image), arrival order
+		active = {}  # future => (tile, tile_image)
+		pool = ThreadPoolExecutor(max_workers=self.settings.get("assembly_threads", ASSEMBLY_THREADS))
+		while not self.slicer.done() or active:
+			# get finished tiles, only block if there's nothing else to do (with timeout to notice aborts)
+			try:
+				pending.append(self.queue.get(block=not (pending or active), timeout=0.3))
+				while True:
+					pending.append(self.queue.get_nowait())
+			except Empty:
+				pass
+			# start all tiles that don't overlap running/earlier waiting ones
+			blocked = [x[0] for x in active.values()]
+			for item in list(pending):
+				if any(item[0].overlaps(x) for x in blocked):
+					blocked.append(item[0])
+					continue
+				pending.remove(item)
+				active[pool.submit(self.assemble_tile, *item, get_mask)] = item
+			# wait for running tiles, short timeout to pick up new ones
+			finished, _ = wait(list(active.keys()), timeout=0.05, return_when=FIRST_COMPLETED)
+			for future in finished:
+				item = active.pop(future)
+				tile = item[0]
+				try:
+					future.result()
+				except Exception as e:
+					log(f"Failed to assemble tile {tile} ({e})", "error")
+					log(f"Tile {tile} traceback:\n{traceback.format_exc()}", "debug")
+					# tile would stay in processing forever, likely the same for the rest of them
+					if not self.aborted:
+						self.error = f"Failed to assemble tile {tile} ({e})"
+						self.abort()
+				# end queue job, frees up space for dispatching new tiles
+				self.queue.done(item)
+		pool.shutdown()
+		# aborted - release tiles that were never assembled, otherwise queue.join() never returns
+		while True:
+			try:
+				pending.append(self.queue.get_nowait())
+			except Empty:
+				break
+		for item in pending:
+			self.queue.done(item)
+		if pending:
+			log(f"Dropped {len(pending)} finished tiles that weren't assembled", "debug")
+
+	def assemble_tile(self, tile, tile_image, get_mask):
+		"""
+		Paste single finished tile onto the output. Assembler pool thread.
+		"""
+		start = time.time()
+		if self.compositor:
+			self.image = self.compositor.put(tile, tile_image)
+		else:
+			self.image = tile.put(self.image, tile_image, get_mask(tile, tile_image.shape))
+		# store finished tile for resuming
+		if self.checkpoint and tile not in self.restored:
+			try:
+				self.checkpoint.add_tile(tile, tile_image)
+			except Exception as e:
+				log(f"Failed to checkpoint tile {tile} ({e})", "warning")
+		# hand off to previewer, updated separately
+		if self.previewer:
+			self.previewer.add_tile(tile)
+		if self.pyramid:
+			self.pyramid.mark_dirty(tile)
+		# mark tile as done
+		with self.lock:
+			tile.done = True
+			tile.worker = None
+			tile.proc = False
+			self.assembly_count += 1
+			self.assembly_time += time.time() - start
+		self.sample_rss()
+		self.pbar.update()
+		self.emit("tile", {
+			"h": tile.h, "w": tile.w, "state": "done",
+			"rect": [tile.h_start, tile.h_end, tile.w_start, tile.w_end],
+		})
+		self.emit("progress", self.get_progress())
 
 	def abort(self):
 		"""
@@ -199,10 +590,85 @@ class TiledUpscaleJob:
 		"""
 		log("Job aborted.", "warning")
 		self.save = False
+		self.aborted = True
+		if self.checkpoint:
+			log(f"Finished tiles kept in checkpoint '{self.checkpoint.name}'", "info")
 		# todo: this definitely needs to be less medieval than this
 		[x.abort() for x in self.workers]
 		self.slicer.tiles = []
 
+	def emit(self, kind, data=None):
+		"""
+		Publish job event, if anyone is listening
+		"""
+		if self.events:
+			self.events.publish(kind, data)
+
+	def get_progress(self):
+		"""
+		Get progress info + formatted label
+		"""
+		n, total = self.pbar.n, self.pbar.total
+		return {
+			"current": n,
+			"total": total,
+			"perc": round(n/total,2) if total else 1.0,
+			"label": self.pbar.format_meter(
+				n,
+				total,
+				self.pbar.format_dict.get("elapsed", 1),
+				ascii = True,
+				unit  = "Tile",
+				bar_format = "[{n_fmt}/{total_fmt} | {elapsed}&lt{remaining} | {rate_fmt}{postfix}]",
+			).replace("  "," "),
+		}
+
+	def sample_rss(self):
+		"""
+		Update peak resident memory of this job from the current value
+		"""
+		rss = get_current_rss()
+		if rss is None:
+			return
+		with self.lock:
+			self.rss_peak = max(self.rss_peak or 0, rss)
+
+	def get_memory_info(self):
+		"""
+		Get projected/measured memory use in MiB
+		"""
+		# process-wide and monotonic, so only sample while running
+		if self.peak_rss is not None and not self.done():
+			self.peak_rss = get_peak_rss()
+			self.sample_rss()
+		info = {k:round(v/1024**2) for k,v in self.memory.items()}
+		if self.rss_peak is not None:
+			info["job_start"] = round(self.rss_start/1024**2)
+			info["job_peak"] = round(self.rss_peak/1024**2)
+		if self.peak_rss is not None:
+			# high-water mark since the server started, can come from an earlier job
+			info["process_peak"] = round(self.peak_rss/1024**2)
+		return info
+
+	def get_queue_info(self):
+		"""
+		Get result queue stats (depth, MiB held, wait time in seconds)
+		"""
+		if not hasattr(self, "queue"):
+			return {}
+		return self.queue.get_info()
+
+	def get_assembly_info(self):
+		"""
+		Get assembly stats (times in seconds), see previewer for preview stats
+		"""
+		with self.lock:
+			return {
+				"tiles": self.assembly_count,
+				"time": round(self.assembly_time, 3),
+				"time_avg": round(self.assembly_time/max(self.assembly_count, 1), 4),
+			}
+
 	def done(self):
 		"""
 		Check if job is finished.
@@ -0,0 +1,78 @@
+#
+# Job event broadcasting (pushed to browsers, see server/control.py)
+#
+import time
+import asyncio
+from threading import Lock
+
+from .utils import log
+
+EVENT_QUEUE_SIZE = 256 # max. events buffered per listener before dropping
+
+class EventBroadcaster:
+	"""
+	Thread-safe fan-out of job events to async listeners.
+	Events can be published from any thread, listeners are asyncio queues on the server loop.
+	"""
+	def __init__(self):
+		self.lock = Lock()
+		self.listeners = [] # (loop, queue)
+		self.dropped = 0
+
+	def subscribe(self):
+		"""
+		Add listener for the running loop. Async only.
+		"""
+		queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+		with self.lock:
+			self.listeners.append((asyncio.get_running_loop(), queue))
+		return queue
+
+	def unsubscribe(self, queue):
+		"""
+		Remove listener (client disconnected)
+		"""
+		with self.lock:
+			self.listeners = [x for x in self.listeners if x[1] is not queue]
+
+	def publish(self, kind, data=None):
+		"""
+		Send event to all listeners. Never blocks.
+		kind: event type [status|tile|preview]
+		data: json serializable event data
+		"""
+		event = {"type": kind, "time": time.time(), "data": data or {}}
+		with self.lock:
+			listeners = self.listeners.copy()
+		for loop, queue in listeners:
+			try:
+				loop.call_soon_threadsafe(self.put, queue, event)
+			except RuntimeError: # loop closed
+				self.unsubscribe(queue)
+
+	def put(self, queue, event):
+		"""
+		Add event to listener queue. Runs on the listener loop.
+		"""
+		try:
+			queue.put_nowait(event)
+		except asyncio.QueueFull:
+			# slow client, it'll catch up on the next status event
+			self.dropped += 1
+			if self.dropped % 100 == 1:
+				log(f"Event listener too slow, dropped {self.dropped} events", "debug")
+
+	def count(self):
+		"""
+		Get number of listeners
+		"""
+		with self.lock:
+			return len(self.listeners)
+
+job_events = EventBroadcaster()
+
+def get_job_events():
+	"""
+	Return global job event broadcaster
+	"""
+	return job_events
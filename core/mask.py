@@ -2,33 +2,109 @@
 # Mask creation/editing logic
 #
 import torch
+import torchvision.transforms.functional as F
+from functools import lru_cache
+
 from .utils import sanitize
 
-def get_mask(shape, feather, padding):
+MASK_CACHE_SIZE = 128 # max. number of distinct masks kept around
+EDGES = ("h_start", "h_end", "w_start", "w_end")
+
+def get_ramp(length, feather, padding):
+	"""
+	Create a 1D [length] ramp: zero for padding, linear fade over feather, one in the center.
+	"""
+	half = torch.arange(length//2, dtype=torch.float32)
+	if feather > 0:
+		half = torch.clamp((half - padding + 1) / feather, 0.0, 1.0)
+	else:
+		half = (half >= padding).float()
+	return torch.cat((half, torch.flip(half, dims=(0,))))
+
+def fix_ramp_edge(ramp, start=False, end=False, perc=0.5):
+	"""
+	1D equivalent of fix_mask_edge, stretches the ramp center to the requested ends.
+	"""
+	com = ramp.shape[0]//2
+	lim = int(ramp.shape[0]*perc)
+	if start:
+		ramp[:lim] = ramp[com]
+	if end and lim > 1:
+		ramp[-(lim-1):] = ramp[com]
+	return ramp
+
+def get_mask(shape, feather, padding, edges=()):
 	"""
 	Create a [B,C,H,W] mask with soft edges and optional padding around the borders.
 	<get_center_mask(9) equiv is s=512|f=56|p=28>
+	edges: image edges the mask should be stretched to (see fix_mask_edge)
 	"""
 	assert (shape[2]%2==0 and shape[3]%2==0),"Mask size must be divisible by 2!"
-	mask = torch.ones((shape[2]//2,shape[3]//2), dtype=torch.float32)
-
-	# zero out offset region
-	for k in range(padding):
-		mask[k] *= 0.0
-		mask[:, k] *= 0.0
-
-	# fade out overlap region
-	for k in range(feather):
-		perc = (k+1)/feather
-		mask[padding+k] *= perc
-		mask[:, padding+k] *= perc
-
-	# Rebuild mask from single corner, then expand to channels/batch
-	mask = torch.cat((mask, torch.flip(mask, dims=(0,)))) 
-	mask = torch.cat((mask, torch.flip(mask, dims=(1,))),dim=1)
-	mask = mask.unsqueeze(0).unsqueeze(0).repeat(shape[0], shape[1], 1, 1) 
+	h_ramp = get_ramp(shape[2], feather, padding)
+	w_ramp = get_ramp(shape[3], feather, padding)
+
+	# mask is separable, so edges can be fixed on the ramps directly
+	h_ramp = fix_ramp_edge(h_ramp, "h_start" in edges, "h_end" in edges)
+	w_ramp = fix_ramp_edge(w_ramp, "w_start" in edges, "w_end" in edges)
+
+	# outer product, then expand to channels/batch
+	mask = h_ramp.unsqueeze(1) * w_ramp.unsqueeze(0)
+	mask = mask.unsqueeze(0).unsqueeze(0).repeat(shape[0], shape[1], 1, 1)
 	return mask
 
+@lru_cache(maxsize=MASK_CACHE_SIZE)
+def _get_mask_cached(shape, feather, padding, edges, size):
+	if size:
+		mask = _get_mask_cached(shape, feather, padding, edges, None)
+		return F.resize(mask, list(size), antialias=True)
+	return get_mask(shape, feather, padding, edges)
+
+def get_mask_cached(shape, feather, padding, edges=(), size=None):
+	"""
+	Cached version of get_mask, optionally resized to [size] (H,W).
+	Returned tensors are shared, so they should never be modified in place.
+	"""
+	shape = tuple(shape)
+	size = tuple(size) if size else None
+	if size == shape[2:]:
+		size = None
+	return _get_mask_cached(shape, feather, padding, tuple(edges), size)
+
+def get_distance_ramp(length, start=False, end=False):
+	"""
+	Create a 1D [length] ramp with the distance (in pixels) to the nearest tile border.
+	Borders that are also image edges are ignored, since nothing overlaps them.
+	"""
+	k = torch.arange(length, dtype=torch.float32)
+	dist = torch.full((length,), float(length))
+	if not start:
+		dist = torch.minimum(dist, k + 1.0)
+	if not end:
+		dist = torch.minimum(dist, length - k)
+	return dist
+
+@lru_cache(maxsize=MASK_CACHE_SIZE)
+def _get_weight_mask(shape, edges):
+	h_dist = get_distance_ramp(shape[2], "h_start" in edges, "h_end" in edges)
+	w_dist = get_distance_ramp(shape[3], "w_start" in edges, "w_end" in edges)
+	weight = torch.minimum(h_dist.unsqueeze(1), w_dist.unsqueeze(0))
+	return weight.unsqueeze(0).unsqueeze(0).repeat(shape[0], 1, 1, 1)
+
+def get_weight_mask(shape, edges=()):
+	"""
+	Create a [B,1,H,W] distance-to-edge weight map for weighted compositing.
+	Returned tensors are shared, so they should never be modified in place.
+	"""
+	return _get_weight_mask(tuple(shape), tuple(edges))
+
+def get_tile_edges(tile):
+	"""
+	Get tuple of image edges the tile touches. Used as part of the cache key.
+	"""
+	if tile is None:
+		return ()
+	return tuple(x for x in EDGES if tile.is_edge(x))
+
 def fix_mask_edge(mask, tile, perc=0.5):
 	"""
 	Stretch mask to the edge of the image for edge/corner tiles.
@@ -42,20 +118,16 @@ def fix_mask_edge(mask, tile, perc=0.5):
 	w_lim = int(mask.shape[3]*perc)
 
 	if tile.is_edge("h_start"):
-		for k in range(h_lim):
-			mask[:, :, k] = mask[:, :, h_com]
+		mask[:, :, :h_lim] = mask[:, :, h_com:h_com+1]
 
 	if tile.is_edge("w_start"):
-		for k in range(w_lim):
-			mask[:, :, :, k] = mask[:, :, :, w_com]
+		mask[:, :, :, :w_lim] = mask[:, :, :, w_com:w_com+1]
 
-	if tile.is_edge("h_end"):
-		for k in range(1,h_lim):
-			mask[:, :, -k] = mask[:, :, h_com]
+	if tile.is_edge("h_end") and h_lim > 1:
+		mask[:, :, -(h_lim-1):] = mask[:, :, h_com:h_com+1]
 
-	if tile.is_edge("w_end"):
-		for k in range(1,w_lim):
-			mask[:, :, :, -k] = mask[:, :, :, w_com]
+	if tile.is_edge("w_end") and w_lim > 1:
+		mask[:, :, :, -(w_lim-1):] = mask[:, :, :, w_com:w_com+1]
 
 	return mask
 
@@ -65,7 +137,7 @@ class MaskBuilder:
 	"""
 	def __init__(self, mode="default", **kwargs):
 		if mode == "default":
-			self.mask_func = get_mask
+			self.mask_func = get_mask_cached
 			self.mask_args = {
 				"feather": kwargs.get("feather", 0),
 				"padding": kwargs.get("padding", 0),
@@ -73,8 +145,16 @@ class MaskBuilder:
 		else:
 			raise ValueError(f"Unknown mask type '{mode}'!")
 
-	def from_shape(self, shape):
+	def from_shape(self, shape, tile=None, size=None):
 		"""
 		Create [B,C,H,W] mask from shape w/ initial settings
+		tile: stretch mask to the image edges this tile touches
+		size: resize final mask to (H,W)
+		! result is cached/shared, don't modify it in place
 		"""
-		return self.mask_func(shape, **self.mask_args)
+		return self.mask_func(
+			shape = shape,
+			edges = get_tile_edges(tile),
+			size  = size,
+			**self.mask_args,
+		)
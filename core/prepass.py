@@ -0,0 +1,135 @@
+#
+# Global pre-pass (e.g. model upscale) over the whole image, distributed across workers
+#
+import time
+import torch
+import traceback
+from queue import Queue, Empty
+from threading import Thread, Lock
+
+from .utils import to_float, from_float, log
+from .canvas import new_canvas
+from .resize import resize_to_canvas
+from .workflow import WorkflowTemplate
+
+PREPASS_CHUNK = 512 # chunk size (pre-pass input pixels)
+PREPASS_PAD = 16 # extra context around each chunk, cropped off again (pre-pass input pixels)
+PREPASS_RETRIES = 3 # max. attempts per chunk
+
+class PrePass:
+	"""
+	Run a separate workflow over the whole image in coarse, non-overlapping chunks.
+	The source is downscaled by the workflow upscale factor first, chunks are spread across
+	all workers, then the outputs are stitched into a new full size canvas.
+	"""
+	def __init__(self, image, workers, workflow, upscale_factor=1.0, chunk_size=PREPASS_CHUNK, pad=PREPASS_PAD):
+		"""
+		image: [B,C,H,W] full size source canvas
+		workers: workers to spread the chunks across
+		workflow: pre-pass workflow (single input/output image)
+		upscale_factor: how much the workflow upscales its input
+		chunk_size: chunk size in pre-pass input pixels
+		pad: context around each chunk in pre-pass input pixels
+		"""
+		self.image = image
+		self.workers = workers
+		self.template = WorkflowTemplate(workflow)
+		self.upscale_factor = upscale_factor
+		self.pad = pad
+		self.lock = Lock()
+
+		# downscaled pre-pass input
+		self.height = max(round(image.shape[2] / upscale_factor), 1)
+		self.width = max(round(image.shape[3] / upscale_factor), 1)
+		self.scale_h = image.shape[2] / self.height
+		self.scale_w = image.shape[3] / self.width
+		self.chunks = [
+			(h, min(h+chunk_size, self.height), w, min(w+chunk_size, self.width))
+			for h in range(0, self.height, chunk_size)
+			for w in range(0, self.width, chunk_size)
+		]
+		self.done = 0
+		self.time = 0.0
+
+	def get_info(self):
+		with self.lock:
+			return {
+				"done": self.done,
+				"total": len(self.chunks),
+				"time": round(self.time, 2),
+			}
+
+	def run(self, dtype=torch.float32, backend="memory"):
+		"""
+		Run pre-pass to completion. Blocking. Returns new full size canvas.
+		"""
+		start = time.time()
+		if self.upscale_factor != 1.0:
+			small = new_canvas((*self.image.shape[:2], self.height, self.width), torch.uint8)
+			small = resize_to_canvas(self.image, small, (self.height, self.width))
+		else:
+			small = self.image
+		output = new_canvas(self.image.shape, dtype, backend)
+		log(f"Pre-pass: {len(self.chunks)} chunks at {self.width}x{self.height} on {len(self.workers)} workers", "info")
+
+		# each worker pulls chunks until none are left, failed chunks are put back
+		queue = Queue()
+		[queue.put((x, 0)) for x in self.chunks]
+		failed = []
+		def worker_loop(worker):
+			while True:
+				try:
+					chunk, tries = queue.get_nowait()
+				except Empty:
+					return
+				try:
+					self.process_chunk(worker, small, output, chunk)
+				except Exception as e:
+					log(f"Pre-pass chunk {chunk} failed on {worker} ({e})", "warning")
+					log(f"Pre-pass traceback:\n{traceback.format_exc()}", "debug")
+					if tries+1 < PREPASS_RETRIES:
+						queue.put((chunk, tries+1))
+					else:
+						failed.append(chunk)
+					if worker.state == "fail":
+						return
+				else:
+					with self.lock:
+						self.done += 1
+		threads = [Thread(target=worker_loop, args=(x,), daemon=True) for x in self.workers]
+		[x.start() for x in threads]
+		[x.join() for x in threads]
+
+		with self.lock:
+			self.time = time.time() - start
+		if failed or self.done < len(self.chunks):
+			raise RuntimeError(f"Pre-pass failed for {len(self.chunks) - self.done} chunks!")
+		log(f"Pre-pass done in {self.time:.2f}s", "info")
+		self.image = None # old tile source, can be freed
+		return output
+
+	def process_chunk(self, worker, small, output, chunk):
+		"""
+		Run single chunk (with context) on worker, write the output without the context to the canvas
+		"""
+		h_start, h_end, w_start, w_end = chunk
+		# input area incl. context
+		ih_start, ih_end = max(h_start-self.pad, 0), min(h_end+self.pad, self.height)
+		iw_start, iw_end = max(w_start-self.pad, 0), min(w_end+self.pad, self.width)
+		image = to_float(small[:, :, ih_start:ih_end, iw_start:iw_end], copy=True)
+		out = worker.process(image, {"workflow_template": self.template, "upscale_factor": 1.0})
+		# scale to exact output size in case the workflow rounds
+		oh_start, oh_end = round(ih_start*self.scale_h), round(ih_end*self.scale_h)
+		ow_start, ow_end = round(iw_start*self.scale_w), round(iw_end*self.scale_w)
+		if tuple(out.shape[2:]) != (oh_end-oh_start, ow_end-ow_start):
+			out = torch.nn.functional.interpolate(
+				out,
+				size = (oh_end-oh_start, ow_end-ow_start),
+				mode = "bicubic",
+				antialias = True,
+			).clamp(0.0, 1.0)
+		# drop context
+		th_start, th_end = round(h_start*self.scale_h), round(h_end*self.scale_h)
+		tw_start, tw_end = round(w_start*self.scale_w), round(w_end*self.scale_w)
+		out = out[:, :output.shape[1], th_start-oh_start:th_end-oh_start, tw_start-ow_start:tw_end-ow_start]
+		output[:, :, th_start:th_end, tw_start:tw_end] = from_float(out, output.dtype)
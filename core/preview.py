@@ -1,104 +1,339 @@
 #
 # Main logic for live preview during processing
 #
+import math
 import time
 import torch
+from io import BytesIO
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont
-from threading import Thread, Lock
+from threading import Thread, Lock, Event
+from torchvision.transforms.functional import to_pil_image
 
-from .utils import sanitize, get_text
+from .utils import sanitize, get_text, to_float, from_float
 
 OVERLAY = get_text("Preview", scale=4)
+PREVIEW_FORMATS = {
+	"jpeg": "image/jpeg",
+	"webp": "image/webp",
+}
+PREVIEW_DIRTY_MAX = 32 # dirty rects before falling back to a full redraw
+PREVIEW_BATCH_DELAY = 0.25 # seconds to wait for more finished tiles before updating the preview
+PREVIEW_BAND = 64 # preview rows per band when building/redrawing the full preview
+
+# defaults for encoded previews, see set_preview_settings
+preview_settings = {
+	"format": "jpeg",
+	"quality": 90,
+	"size": 0, # max. width/height, 0 = native preview size
+}
+
+def set_preview_settings(**kwargs):
+	"""
+	Set default format/quality/size for encoded previews (on startup)
+	"""
+	for k, v in kwargs.items():
+		if v is None:
+			continue
+		assert k in preview_settings, f"Unknown preview setting '{k}'!"
+		preview_settings[k] = v
+	assert preview_settings["format"] in PREVIEW_FORMATS, f"Invalid preview format '{preview_settings['format']}'!"
+
+@lru_cache(maxsize=64)
+def get_name_overlay(name):
+	"""
+	Get rendered worker name for the tile overlay
+	! cached, don't modify in place
+	"""
+	return get_text(name, scale=2)*4.0+0.2
+
+def paste_clipped(dst, rect, h_start, h_end, w_start, w_end, value):
+	"""
+	Write value (scalar or [h,w] tensor) to absolute coordinates, clipped to the region dst covers.
+	dst: [B,C,H,W] tensor covering rect (h_start, h_end, w_start, w_end)
+	"""
+	h0, w0 = max(h_start, rect[0]), max(w_start, rect[2])
+	h1, w1 = min(h_end, rect[1]), min(w_end, rect[3])
+	if h0 >= h1 or w0 >= w1:
+		return
+	if torch.is_tensor(value):
+		value = value[h0-h_start:h1-h_start, w0-w_start:w1-w_start]
+	dst[:, :, h0-rect[0]:h1-rect[0], w0-rect[2]:w1-rect[2]] = value
+
+def get_preview_scale(height):
+	"""
+	Get default preview scale based on image height
+	"""
+	if height > 2048:
+		return 0.25
+	elif height > 1024:
+		return 0.5
+	return 1.0
 
 class TiledUpscalePreviewer:
 	"""
 	Previewer with separate thread and polling updates.
 	"""
-	def __init__(self, slicer, image, scale=None):
+	def __init__(self, slicer, image, scale=None, backend="memory"):
 		"""
 		slicer: slicer object being used
-		image: scaled image that the output will be pasted onto
-		polling: how often to check for changes (seconds)
+		image: full size output image, finished tiles are copied from it
+		scale: preview scale, default depends on image size
+		backend: canvas backend for the (uint8) preview images, see new_canvas
 		"""
+		from .canvas import new_canvas # circular import
 		if not scale:
-			if image.shape[2] > 2048:
-				scale = 0.25
-			elif image.shape[2] > 1024:
-				scale = 0.5
-			else:
-				scale = 1.0
+			scale = get_preview_scale(image.shape[2])
 
 		self.slicer = slicer
 		self.scale = scale
-		self.image = torch.nn.functional.interpolate(
-				image,
-				scale_factor = self.scale,
-				mode = "nearest",
-		)
-		self.preview = self.image.clone()
+		self.source = image
+		self.backend = backend
+		shape = (*image.shape[:2], math.floor(image.shape[2]*scale), math.floor(image.shape[3]*scale))
+		self.image = new_canvas(shape, torch.uint8, backend)
+		# nearest downscale in bands (same sampling as interpolate), no full size temporaries
+		w_idx = (torch.arange(shape[3]) / scale).floor().long().clamp(max=image.shape[3]-1)
+		for h in range(0, shape[2], PREVIEW_BAND):
+			h_idx = (torch.arange(h, min(h+PREVIEW_BAND, shape[2])) / scale).floor().long().clamp(max=image.shape[2]-1)
+			band = image[:, :, h_idx][:, :, :, w_idx]
+			self.image[:, :, h:h+len(h_idx)] = from_float(to_float(band), torch.uint8)
+		self.preview = None # uint8, drawn on first request
 		self.changed = time.time()
 		self.updated = 0
 		self.lock = Lock()
+		self.render_lock = Lock()
+		self.dirty = [] # preview space (h_start, h_end, w_start, w_end) rects changed since last draw
+		self.drawn = {} # tile => worker name, tiles in the last drawn overlay
+		self.encoded = None # (key, bytes) of the last encoded preview
+		self.on_change = None # callback(changed), called after the preview changed
+
+		# finished tiles are copied over in batches by a separate thread
+		self.pending = {} # tile => time it was added
+		self.event = Event()
+		self.stopped = False
+		self.stats = {
+			"updates": 0,
+			"tiles": 0,
+			"time": 0.0, # total time spent updating
+			"latency_total": 0.0, # tile added => visible
+			"latency_max": 0.0,
+		}
+		self.updater = Thread(target=self.update_loop, daemon=True)
+		self.updater.start()
+
+	def add_tile(self, tile):
+		"""
+		Queue finished tile to be copied to the preview. Cheap, called by the assembler.
+		"""
+		with self.lock:
+			self.pending.setdefault(tile, time.time())
+		self.event.set()
+
+	def update_loop(self):
+		"""
+		Copy finished tiles to the preview image in batches. Separate thread.
+		"""
+		while not self.stopped:
+			self.event.wait()
+			# give other tiles finishing around the same time a chance to be merged in
+			time.sleep(PREVIEW_BATCH_DELAY)
+			self.event.clear()
+			self.update_tiles()
+
+	def update_tiles(self):
+		"""
+		Copy all pending tiles from the full size image to the preview image
+		"""
+		with self.lock:
+			pending, self.pending = self.pending, {}
+		if not pending:
+			return
+		start = time.time()
+		for tile in pending.keys():
+			h_start, h_end, w_start, w_end = self.get_tile_rect(tile)
+			if h_start >= h_end or w_start >= w_end:
+				continue
+			out = torch.nn.functional.interpolate(
+				to_float(tile.crop(self.source, clone=False)),
+				size = (h_end-h_start, w_end-w_start),
+				mode = "nearest",
+			)
+			self.image[:, :, h_start:h_end, w_start:w_end] = from_float(out, torch.uint8)
+		end = time.time()
+		with self.lock:
+			self.dirty += [self.get_tile_rect(x) for x in pending.keys()]
+			self.changed = end
+			self.stats["updates"] += 1
+			self.stats["tiles"] += len(pending)
+			self.stats["time"] += end - start
+			for added in pending.values():
+				self.stats["latency_total"] += end - added
+				self.stats["latency_max"] = max(self.stats["latency_max"], end - added)
+		if self.on_change:
+			self.on_change(end)
+
+	def stop(self):
+		"""
+		Stop update thread and apply remaining tiles (job finished)
+		"""
+		self.stopped = True
+		self.event.set()
+		self.updater.join()
+		self.update_tiles()
+
+	def get_info(self):
+		"""
+		Get preview update stats (times in seconds)
+		"""
+		with self.lock:
+			stats = self.stats.copy()
+			pending = len(self.pending)
+		return {
+			"updates": stats["updates"],
+			"tiles": stats["tiles"],
+			"pending": pending,
+			"time": round(stats["time"], 3),
+			"time_avg": round(stats["time"]/max(stats["updates"], 1), 4),
+			"latency_avg": round(stats["latency_total"]/max(stats["tiles"], 1), 3),
+			"latency_max": round(stats["latency_max"], 3),
+		}
+
+	def get_tile_rect(self, tile, scale=None):
+		"""
+		Get tile coordinates in preview space
+		"""
+		scale = scale or self.scale
+		return (
+			round(tile.h_start*scale), round(tile.h_end*scale),
+			round(tile.w_start*scale), round(tile.w_end*scale),
+		)
 
 	def mark_change(self):
 		"""
-		Mark preview as changed.
+		Mark preview as changed. Image changes are tracked per tile, see add_tile.
 		"""
 		with self.lock:
 			self.changed = time.time()
+		if self.on_change:
+			self.on_change(self.changed)
 
 	def get_preview(self):
 		"""
-		Get preview of the full image.
+		Get preview of the full image. Only redraws areas that changed since the last call.
 		"""
 		with self.lock:
 			done = self.slicer.done()
-			proc = [x for x in self.slicer.tiles if x.proc]
-		if self.changed != self.updated and not done:
-			if len(proc) > 0: # looks stupid without any tiles
-				self.preview = self.draw_overlay()
-				self.updated = self.changed
-		elif self.changed != self.updated and done:
-			self.preview = self.draw_overlay()
-			self.updated = self.changed
-		return self.preview
+			proc = {x:(x.worker.name if x.worker else None) for x in self.slicer.tiles if x.proc}
+			changed = self.changed
+		with self.render_lock:
+			if changed == self.updated:
+				return self.preview
+			if not done and len(proc) == 0 and self.preview is not None:
+				return self.preview # looks stupid without any tiles
+			with self.lock:
+				dirty, self.dirty = self.dirty, []
+			# tiles that were added/removed from the overlay (or changed worker)
+			for tile in set(proc.keys()) | set(self.drawn.keys()):
+				if proc.get(tile) != self.drawn.get(tile):
+					dirty.append(self.get_tile_rect(tile))
+			if self.preview is None or len(dirty) > PREVIEW_DIRTY_MAX:
+				# full redraw, in bands to keep the float temporaries small
+				if self.preview is None:
+					from .canvas import new_canvas # circular import
+					self.preview = new_canvas(self.image.shape, torch.uint8, self.backend)
+				for h in range(0, self.image.shape[2], PREVIEW_BAND):
+					self.draw_rect((h, h+PREVIEW_BAND, 0, self.image.shape[3]), proc)
+			else:
+				for rect in dirty:
+					self.draw_rect(rect, proc)
+			self.drawn = proc
+			self.updated = changed
+			return self.preview
 
-	def draw_overlay(self, image=None, scale=None):
+	def get_encoded(self, fmt=None, quality=None, size=None):
 		"""
-		Paste map of tiles being processed over provided or final image
+		Get encoded preview image as bytes. The last result is reused until the preview changes.
+		fmt: image format [jpeg|webp]
+		quality: encoder quality (1-100)
+		size: max. width/height, 0 for native preview size
 		"""
-		image = image or self.image.clone()
+		fmt = fmt or preview_settings["format"]
+		quality = int(quality or preview_settings["quality"])
+		size = int(size if size is not None else preview_settings["size"])
+		assert fmt in PREVIEW_FORMATS, f"Invalid preview format '{fmt}'!"
+		image = self.get_preview()
+		with self.render_lock:
+			key = (self.updated, fmt, quality, size)
+			if self.encoded and self.encoded[0] == key:
+				return self.encoded[1]
+			img = to_pil_image(image[0])
+			if size and max(img.size) > size:
+				img.thumbnail((size, size), Image.BILINEAR)
+			tmp = BytesIO()
+			if fmt == "jpeg":
+				img.save(tmp, "jpeg", subsampling=0, quality=quality)
+			else:
+				img.save(tmp, "webp", quality=quality)
+			self.encoded = (key, tmp.getvalue())
+			return self.encoded[1]
+
+	def draw_rect(self, rect, tiles):
+		"""
+		Redraw single area (preview space) of the preview with the overlay
+		"""
+		h_start, h_end, w_start, w_end = rect
+		h_start, w_start = max(h_start, 0), max(w_start, 0)
+		h_end, w_end = min(h_end, self.image.shape[2]), min(w_end, self.image.shape[3])
+		if h_start >= h_end or w_start >= w_end:
+			return
+		rect = (h_start, h_end, w_start, w_end)
+		image = self.image[:, :, h_start:h_end, w_start:w_end]
+		self.preview[:, :, h_start:h_end, w_start:w_end] = self.draw_overlay(image, tiles=tiles, rect=rect)
+
+	def draw_overlay(self, image=None, scale=None, tiles=None, rect=None):
+		"""
+		Paste map of tiles being processed over provided or final image, returns uint8
+		tiles: tile => worker name dict, defaults to tiles currently being processed
+		rect: area the image covers, defaults to the full image
+		"""
+		image = to_float(self.image if image is None else image, copy=True)
 		scale = scale or self.scale
-		overlay = self.get_overlay()
+		overlay = self.get_overlay(scale, tiles=tiles, rect=rect)
 		mask = overlay>0.0
 		prev = (image*overlay)
 		image[mask] *= 0.25
 		image += prev
-		return torch.clamp(image, 0.0, 1.0)
+		return from_float(torch.clamp(image, 0.0, 1.0), torch.uint8)
 
-	def get_overlay(self, scale=None):
+	def get_overlay(self, scale=None, tiles=None, rect=None):
 		"""
 		Get an overlay with the current tiles being processed outlined
+		tiles: tile => worker name dict, defaults to tiles currently being processed
+		rect: only render this area (preview space), defaults to the full image
 		"""
 		scale = scale or self.scale
-		overlay = torch.zeros_like(self.image)
-		for tile in [x for x in self.slicer.tiles if x.proc]:
-			if not tile.proc:
+		if tiles is None:
+			tiles = {x:(x.worker.name if x.worker else None) for x in self.slicer.tiles if x.proc}
+		if rect is None:
+			rect = (0, self.image.shape[2], 0, self.image.shape[3])
+		shape = (self.image.shape[0], self.image.shape[1], rect[1]-rect[0], rect[3]-rect[2])
+		overlay = torch.zeros(shape, dtype=torch.float32)
+		for tile, name in tiles.items():
+			h_start, h_end, w_start, w_end = self.get_tile_rect(tile, scale)
+			if h_start >= rect[1] or h_end <= rect[0] or w_start >= rect[3] or w_end <= rect[2]:
 				continue
-			h_start = round(tile.h_start*scale)
-			h_end   = round(tile.h_end*scale)
-			w_start = round(tile.w_start*scale)
-			w_end   = round(tile.w_end*scale)
 			pad = 14
 
-			overlay[:, :, h_start:h_end,w_start:w_end] = 0.2
-			overlay[:, :, h_start+pad:h_end-pad,w_start+pad:w_end-pad] = 0.0
+			paste_clipped(overlay, rect, h_start, h_end, w_start, w_end, 0.2)
+			paste_clipped(overlay, rect, h_start+pad, h_end-pad, w_start+pad, w_end-pad, 0.0)
 
-			text = get_text(tile.worker.name, scale=2)*4.0+0.2
+			if name is None: # restored from checkpoint
+				continue
+			text = get_name_overlay(name)
 			text = text[:h_end-h_start, :w_end-w_start]
-			overlay[:, :, h_end-text.shape[0]:h_end, w_start:w_start+text.shape[1]] = text
+			paste_clipped(overlay, rect, h_end-text.shape[0], h_end, w_start, w_start+text.shape[1], text)
 
-		overlay[:, :, :OVERLAY.shape[0], :OVERLAY.shape[1]] = (OVERLAY*4.0+0.2)
+		paste_clipped(overlay, rect, 0, OVERLAY.shape[0], 0, OVERLAY.shape[1], OVERLAY*4.0+0.2)
 		return overlay
 
 class TiledUpscaleDebugPreviewer(TiledUpscalePreviewer):
@@ -0,0 +1,176 @@
+#
+# Deep zoom (DZI-style) tile pyramid for inspecting large outputs
+#
+import math
+import torch
+from io import BytesIO
+from threading import Lock
+from collections import OrderedDict
+from torchvision.transforms.functional import to_pil_image
+
+from .utils import to_float, from_float, log
+from .canvas import new_canvas
+
+PYRAMID_TILE = 256 # pyramid tile size (px)
+PYRAMID_BASE = 4 # first stored level (downscale factor), finer levels are cropped from the canvas
+PYRAMID_BAND = 256 # stored level rows per band when building the pyramid
+PYRAMID_CACHE = 1024 # max. pyramid tiles kept encoded
+
+class TilePyramid:
+	"""
+	Multi-resolution view of a canvas. Level 0 is 1x1, the last level is full size (same as DZI).
+	Levels at 1/PYRAMID_BASE scale and below are stored (uint8), finer ones are rendered from the canvas.
+	Everything is built on first use and only the changed areas are updated after that.
+	"""
+	def __init__(self, image, tile_size=PYRAMID_TILE, backend="memory"):
+		"""
+		image: [B,C,H,W] canvas, read only
+		tile_size: pyramid tile size
+		backend: canvas backend for the stored levels, see new_canvas
+		"""
+		self.image = image
+		self.backend = backend
+		self.tile_size = tile_size
+		self.height = image.shape[2]
+		self.width = image.shape[3]
+		self.max_level = math.ceil(math.log2(max(self.height, self.width, 2)))
+		self.lock = Lock()
+		self.levels = None # factor => [B,C,h,w] uint8, built on first use
+		self.dirty = [] # full size (h_start, h_end, w_start, w_end) rects not applied to levels yet
+		self.cache = OrderedDict() # (level, col, row) => {(fmt, quality): bytes}
+
+	def get_factor(self, level):
+		return 2**(self.max_level - level)
+
+	def get_level_size(self, level):
+		"""
+		Get (H,W) of pyramid level
+		"""
+		f = self.get_factor(level)
+		return (math.ceil(self.height/f), math.ceil(self.width/f))
+
+	def get_info(self):
+		return {
+			"width": self.width,
+			"height": self.height,
+			"tile_size": self.tile_size,
+			"max_level": self.max_level,
+		}
+
+	def mark_dirty(self, tile=None):
+		"""
+		Mark area of a finished tile (or the full image) as changed. Cheap, called by the assembler.
+		"""
+		rect = (tile.h_start, tile.h_end, tile.w_start, tile.w_end) if tile else (0, self.height, 0, self.width)
+		with self.lock:
+			self.dirty.append(rect)
+
+	def downscale(self, src, factor, h_start, h_end, w_start, w_end):
+		"""
+		Downscale src[h_start:h_end, w_start:w_end] (aligned to factor) by factor, as float
+		"""
+		region = to_float(src[:, :, h_start:h_end, w_start:w_end])
+		if factor == 1:
+			return region
+		return torch.nn.functional.avg_pool2d(region, factor, ceil_mode=True)
+
+	def update_level(self, factor, h_start, h_end, w_start, w_end):
+		"""
+		Recompute area (level coordinates) of a stored level from the next finer one
+		"""
+		if factor == PYRAMID_BASE:
+			src, scale = self.image, PYRAMID_BASE
+		else:
+			src, scale = self.levels[factor//2], 2
+		out = self.downscale(src, scale, h_start*scale, h_end*scale, w_start*scale, w_end*scale)
+		self.levels[factor][:, :, h_start:h_end, w_start:w_end] = from_float(out, torch.uint8)
+
+	def update(self):
+		"""
+		Build stored levels or apply pending changes to them. Caller must hold lock.
+		"""
+		factors = [2**x for x in range(int(math.log2(PYRAMID_BASE)), self.max_level+1)]
+		if self.levels is None:
+			self.dirty = []
+			self.levels = {}
+			for f in factors:
+				h, w = math.ceil(self.height/f), math.ceil(self.width/f)
+				self.levels[f] = new_canvas((self.image.shape[0], self.image.shape[1], h, w), torch.uint8, self.backend)
+				for band in range(0, h, PYRAMID_BAND):
+					self.update_level(f, band, min(band+PYRAMID_BAND, h), 0, w)
+			log(f"Built tile pyramid, {self.max_level+1} levels", "debug")
+			return
+		if not self.dirty:
+			return
+		dirty, self.dirty = self.dirty, []
+		for h_start, h_end, w_start, w_end in dirty:
+			# drop encoded tiles touching the area
+			ts = self.tile_size
+			for level in range(self.max_level+1):
+				f = self.get_factor(level)
+				for row in range(h_start//f//ts, math.ceil(h_end/f/ts)):
+					for col in range(w_start//f//ts, math.ceil(w_end/f/ts)):
+						self.cache.pop((level, col, row), None)
+			# update stored levels, finest first
+			for f in factors:
+				h, w = self.levels[f].shape[2:]
+				self.update_level(
+					f,
+					h_start//f, min(math.ceil(h_end/f), h),
+					w_start//f, min(math.ceil(w_end/f), w),
+				)
+
+	def get_tile(self, level, col, row):
+		"""
+		Get [B,C,h,w] uint8 pyramid tile, None if out of range
+		"""
+		if not 0 <= level <= self.max_level:
+			return None
+		h, w = self.get_level_size(level)
+		ts = self.tile_size
+		if not (0 <= row*ts < h and 0 <= col*ts < w):
+			return None
+		h_start, h_end = row*ts, min((row+1)*ts, h)
+		w_start, w_end = col*ts, min((col+1)*ts, w)
+		f = self.get_factor(level)
+		if f >= PYRAMID_BASE:
+			return self.levels[f][:, :, h_start:h_end, w_start:w_end]
+		# finer levels are cheap enough to render from the canvas directly
+		out = self.downscale(
+			self.image, f,
+			h_start*f, min(h_end*f, self.height),
+			w_start*f, min(w_end*f, self.width),
+		)
+		return from_float(out, torch.uint8)
+
+	def get_encoded(self, level, col, row, fmt="jpeg", quality=90):
+		"""
+		Get encoded pyramid tile as bytes, None if out of range
+		"""
+		key = (level, col, row)
+		with self.lock:
+			self.update()
+			if (fmt, quality) in self.cache.get(key, {}):
+				self.cache.move_to_end(key)
+				return self.cache[key][(fmt, quality)]
+			tile = self.get_tile(level, col, row)
+			if tile is None:
+				return None
+			tmp = BytesIO()
+			to_pil_image(tile[0, :3]).save(tmp, fmt, quality=quality)
+			self.cache.setdefault(key, {})[(fmt, quality)] = tmp.getvalue()
+			self.cache.move_to_end(key)
+			while len(self.cache) > PYRAMID_CACHE:
+				self.cache.popitem(last=False)
+			return self.cache[key][(fmt, quality)]
+
+	def get_dzi(self, fmt="jpeg"):
+		"""
+		Get DZI descriptor xml
+		"""
+		return (
+			'<?xml version="1.0" encoding="UTF-8"?>\n'
+			f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{fmt}" Overlap="0" TileSize="{self.tile_size}">\n'
+			f'\t<Size Width="{self.width}" Height="{self.height}"/>\n'
+			'</Image>\n'
+		)
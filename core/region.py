@@ -0,0 +1,84 @@
+#
+# Region of interest logic for partial re-renders
+#
+import torch
+import torchvision.transforms.functional as F
+
+from .utils import sanitize, to_float, log
+
+def get_rect_ramp(start, end, rect_start, rect_end, feather):
+	"""
+	Create 1D [end-start] ramp that is 1.0 inside the rect, fading to 0.0 at the rect edges.
+	"""
+	k = torch.arange(start, end, dtype=torch.float32)
+	dist = torch.minimum(k - rect_start + 1.0, rect_end - k)
+	if feather > 0:
+		return torch.clamp(dist / feather, 0.0, 1.0)
+	return (dist > 0).float()
+
+class RegionMask:
+	"""
+	Region of the image to re-render, either a rectangle or a mask image.
+	"""
+	def __init__(self, shape, rect=None, mask=None, feather=0):
+		"""
+		shape: [B,C,H,W] shape of the full image
+		rect: (h_start, h_end, w_start, w_end) pixel coordinates
+		mask: [1,1,H,W] uint8/float mask, non-zero = re-render
+		feather: fade width for rect edges (pixels)
+		"""
+		assert (rect is None) != (mask is None), "Region needs exactly one of [rect,mask]!"
+		self.shape = shape
+		self.feather = feather
+		self.rect = None
+		self.mask = None
+		if rect is not None:
+			h_start, h_end, w_start, w_end = [int(x) for x in rect]
+			self.rect = (
+				max(h_start, 0), min(h_end, shape[2]),
+				max(w_start, 0), min(w_end, shape[3]),
+			)
+			assert self.rect[0] < self.rect[1] and self.rect[2] < self.rect[3], f"Empty region '{rect}'!"
+		else:
+			self.mask = sanitize(mask, channels=1)[:, :1]
+			assert tuple(self.mask.shape[2:]) == tuple(shape[2:]), "Region mask size doesn't match image!"
+
+	def intersects(self, tile):
+		"""
+		Check if any part of the tile needs to be re-rendered
+		"""
+		if self.rect is not None:
+			h_start, h_end, w_start, w_end = self.rect
+			return (
+				tile.h_start < h_end and tile.h_end > h_start and
+				tile.w_start < w_end and tile.w_end > w_start
+			)
+		return bool(tile.crop(self.mask, clone=False).any())
+
+	def get(self, tile, size=None):
+		"""
+		Get [1,1,H,W] float region mask for the tile, optionally resized to (H,W)
+		"""
+		if self.rect is not None:
+			h_start, h_end, w_start, w_end = self.rect
+			h_ramp = get_rect_ramp(tile.h_start, tile.h_end, h_start, h_end, self.feather)
+			w_ramp = get_rect_ramp(tile.w_start, tile.w_end, w_start, w_end, self.feather)
+			mask = (h_ramp.unsqueeze(1) * w_ramp.unsqueeze(0)).unsqueeze(0).unsqueeze(0)
+		else:
+			mask = to_float(tile.crop(self.mask, clone=False), copy=True)
+		if size and tuple(size) != tuple(mask.shape[2:]):
+			mask = F.resize(mask, list(size), antialias=True)
+		return mask
+
+def select_region_tiles(slicer, region):
+	"""
+	Mark all tiles that don't touch the region as done. Returns number of tiles left to process.
+	"""
+	count = 0
+	for tile in slicer.tiles:
+		if region.intersects(tile):
+			count += 1
+		else:
+			tile.done = True
+	log(f"Region: processing {count}/{len(slicer.tiles)} tiles", "info")
+	return count
@@ -0,0 +1,107 @@
+#
+# Banded (streaming) image resize logic
+#
+import os
+import math
+import torch
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import to_float, from_float, log
+
+RESIZE_BAND = 32 # output rows per band
+RESIZE_THREADS = os.cpu_count() or 1
+RESIZE_CHUNK = 16 * 1024**2 # width pass temporaries per band (bytes)
+
+def bilinear_kernel(x):
+	return torch.clamp(1.0 - x.abs(), min=0.0)
+
+def bicubic_kernel(x, a=-0.5):
+	x = x.abs()
+	near = ((a + 2.0) * x - (a + 3.0)) * x * x + 1.0
+	far = ((x - 5.0) * x + 8.0) * x * a - 4.0 * a
+	return torch.where(x < 1.0, near, torch.where(x < 2.0, far, torch.zeros_like(x)))
+
+def lanczos_kernel(x, a=3.0):
+	out = torch.sinc(x) * torch.sinc(x / a)
+	return torch.where(x.abs() < a, out, torch.zeros_like(out))
+
+# name => (kernel function, support)
+RESIZE_KERNELS = {
+	"bilinear": (bilinear_kernel, 1.0),
+	"bicubic":  (bicubic_kernel,  2.0),
+	"lanczos":  (lanczos_kernel,  3.0),
+}
+
+def get_resize_weights(in_size, out_size, mode="bicubic"):
+	"""
+	Get source indices and weights [out_size, taps] for resizing a single dimension.
+	Same sampling as PIL, i.e. pixel centers are aligned and the kernel is widened when downscaling.
+	"""
+	assert mode in RESIZE_KERNELS, f"Invalid resize mode '{mode}'!"
+	kernel, support = RESIZE_KERNELS[mode]
+	scale = in_size / out_size
+	filterscale = max(scale, 1.0)
+	radius = support * filterscale
+	taps = int(math.ceil(radius)) * 2 + 1
+
+	center = (torch.arange(out_size, dtype=torch.float64) + 0.5) * scale
+	start = torch.floor(center - radius + 0.5).long()
+	idx = start.unsqueeze(1) + torch.arange(taps).unsqueeze(0)
+	weight = kernel((idx.double() + 0.5 - center.unsqueeze(1)) / filterscale)
+
+	# drop taps outside of the image, then normalize
+	weight = weight * ((idx >= 0) & (idx < in_size))
+	weight = weight / weight.sum(dim=1, keepdim=True)
+	return idx.clamp(0, in_size-1), weight.float()
+
+def resize_band(src, canvas, h_idx, h_weight, w_idx, w_weight, start, end, chunk=RESIZE_CHUNK):
+	"""
+	Resize output rows [start:end] and write them to the canvas.
+	The width pass runs in source row chunks so the gathered taps stay within chunk bytes.
+	"""
+	idx = h_idx[start:end]
+	src_start = int(idx.min())
+	src_end = int(idx.max()) + 1
+	batch, channels = src.shape[0], src.shape[1]
+	rows = max(1, chunk // (batch*channels*(src.shape[3] + w_idx.numel())*4))
+	# width: [B,C,h,W_in] => [B,C,h,W_out]
+	width = torch.empty((batch, channels, src_end-src_start, w_idx.shape[0]), dtype=torch.float32)
+	for x in range(src_start, src_end, rows):
+		part = to_float(src[:, :, x:min(x+rows, src_end)])[:, :, :, w_idx]
+		torch.sum(part.mul_(w_weight), dim=-1, out=width[:, :, x-src_start:x-src_start+part.shape[2]])
+		del part
+	# height: [B,C,h,W_out] => [B,C,end-start,W_out], one tap at a time
+	band = torch.zeros((batch, channels, end-start, w_idx.shape[0]), dtype=torch.float32)
+	for t in range(idx.shape[1]):
+		band.add_(width[:, :, idx[:, t] - src_start] * h_weight[start:end, t].unsqueeze(-1))
+	canvas[:, :, start:end].copy_(from_float(band.clamp_(0.0, 1.0), canvas.dtype))
+
+def estimate_resize_memory(src_shape, size, mode="bicubic", band=RESIZE_BAND, threads=RESIZE_THREADS):
+	"""
+	Peak temporaries (bytes) of resize_to_canvas for a [B,C,H,W] source resized to size (H,W).
+	"""
+	support = RESIZE_KERNELS[mode][1]
+	taps = int(math.ceil(support * max(src_shape[2] / size[0], 1.0))) * 2 + 1
+	rows = int(math.ceil(band * src_shape[2] / size[0])) + taps # source rows per band
+	per_band = RESIZE_CHUNK + src_shape[0]*src_shape[1]*size[1]*4*(rows + band*2)
+	return min(threads, math.ceil(size[0] / band)) * per_band
+
+def resize_to_canvas(src, canvas, size, mode="bicubic", band=RESIZE_BAND, threads=RESIZE_THREADS):
+	"""
+	Resize src to size (H,W) in horizontal bands and write the result straight to the canvas.
+	The canvas can be smaller than size, the output is cropped to it (used for alignment).
+	"""
+	h_idx, h_weight = get_resize_weights(src.shape[2], size[0], mode)
+	w_idx, w_weight = get_resize_weights(src.shape[3], size[1], mode)
+	w_idx, w_weight = w_idx[:canvas.shape[3]], w_weight[:canvas.shape[3]]
+
+	bands = [(x, min(x+band, canvas.shape[2])) for x in range(0, canvas.shape[2], band)]
+	log(f"Resizing {tuple(src.shape[2:])} => {tuple(size)} [{mode}] in {len(bands)} bands", "debug")
+	# torch releases the GIL and bands write to disjoint rows, so threads are fine here
+	with ThreadPoolExecutor(max_workers=threads) as pool:
+		futures = [
+			pool.submit(resize_band, src, canvas, h_idx, h_weight, w_idx, w_weight, *x)
+			for x in bands
+		]
+		[x.result() for x in futures]
+	return canvas
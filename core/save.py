@@ -3,12 +3,14 @@
 #
 import os
 import json
+import zlib
 import torch
+import struct
 from PIL import Image
 from PIL.PngImagePlugin import PngInfo
 from torchvision.transforms.functional import to_pil_image
 
-from .utils import sanitize, log
+from .utils import sanitize, log, to_dtype
 from .path import get_new_path_iter, get_relative_path
 
 META_VER = "LiliumSD-1.0"
@@ -40,9 +42,45 @@ def format_metadata(meta):
 	)
 	return metadata
 
-def save_to_disk(mode, images, ext="png", meta=None):
+PNG_COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6} # channels => color type
+PNG_BAND = 256 # rows per band for streaming
+
+def write_png_chunk(f, cid, data):
+	"""
+	Write single length/type/data/crc PNG chunk to file
+	"""
+	f.write(struct.pack(">I", len(data)))
+	f.write(cid)
+	f.write(data)
+	f.write(struct.pack(">I", zlib.crc32(cid + data) & 0xffffffff))
+
+def save_png_stream(path, image, info=None, band=PNG_BAND, level=6):
+	"""
+	Save [C,H,W] image as 8bit PNG one band of rows at a time.
+	Used for disk-backed canvases, as it never loads the full image into RAM.
+	"""
+	ch, height, width = image.shape
+	assert ch in PNG_COLOR_TYPES, f"Invalid channel count for PNG '{ch}'!"
+	comp = zlib.compressobj(level)
+	with open(path, "wb") as f:
+		f.write(b"\x89PNG\r\n\x1a\n")
+		write_png_chunk(f, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, PNG_COLOR_TYPES[ch], 0, 0, 0))
+		for cid, data, *_ in (info.chunks if info else []):
+			write_png_chunk(f, cid, data)
+		for h in range(0, height, band):
+			rows = to_dtype(image[:, h:h+band], torch.uint8).permute(1, 2, 0).reshape(-1, width*ch)
+			# each row starts with filter type 0 (none)
+			rows = torch.cat([torch.zeros((rows.shape[0], 1), dtype=torch.uint8), rows], dim=1)
+			data = comp.compress(rows.numpy().tobytes())
+			if data:
+				write_png_chunk(f, b"IDAT", data)
+		write_png_chunk(f, b"IDAT", comp.flush())
+		write_png_chunk(f, b"IEND", b"")
+
+def save_to_disk(mode, images, ext="png", meta=None, stream=False):
 	"""
 	Save image to disk with added metadata
+	stream: write PNG in bands instead of converting the full image at once
 	"""
 
 	# construct metadata
@@ -63,7 +101,10 @@ def save_to_disk(mode, images, ext="png", meta=None):
 		if os.path.isfile(path):
 			raise OSError(f"File exists! {path}")
 		# save to disk and track outputs
-		to_pil_image(img).save(path, pnginfo=info)
+		if stream and ext == "png":
+			save_png_stream(path, img, info)
+		else:
+			to_pil_image(img).save(path, pnginfo=info)
 		outputs.append({
 			"name": get_relative_path(mode, path),
 			"mode": mode,
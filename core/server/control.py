@@ -1,27 +1,53 @@
 #
 # Execution / info handling
 #
+import json
 import torch
 import asyncio
+from threading import Lock
 import aiohttp
 from aiohttp import web
 
 from ..mask import MaskBuilder
 from ..path import get_absolute_path, verify_extension
-from ..utils import sanitize, log
+from ..utils import sanitize, log, get_canvas_dtype, CANVAS_DTYPES
 from ..worker import DebugWorker
 from ..slicing import get_slicer
 from ..control import TiledUpscaleJob
-from ..workflow import set_prompt_text, increment_seed
+from ..canvas import load_canvas, estimate_job_memory, fit_memory_budget, CANVAS_BACKENDS
+from ..resize import RESIZE_KERNELS
+from ..composite import COMPOSITOR_DICT
+from ..cache import get_tile_cache
+from ..region import RegionMask
+from ..checkpoint import new_checkpoint, load_checkpoint, list_checkpoints, delete_checkpoint
+from ..preview import preview_settings, PREVIEW_FORMATS
+from ..events import get_job_events
+from ..workflow import set_prompt_text, increment_seed, sanitize_workflow
+from ..prepass import PREPASS_CHUNK
+from ..capability import get_eligible_workers
 
 from .workers import get_workers
+from .executor import run_blocking
 
 current_job = None
+start_lock = Lock() # job start runs in the executor, only one at a time
+EVENT_KEEPALIVE = 15 # seconds between keepalive comments on idle event streams
 
-def start_tiled_upscale_job(data):
+def open_job_image(mode, name):
+	"""
+	Open (lazily) image from one of the media folders. Raises ValueError/FileNotFoundError.
+	"""
+	from PIL import Image
+	path = get_absolute_path(mode, name)
+	verify_extension(path, exception=True)
+	return Image.open(path)
+
+def start_tiled_upscale_job(data, checkpoint=None):
 	"""
 	Setup & launch tiled upscale job
+	checkpoint: JobCheckpoint to resume from, new one is created if not set
 	"""
+	request = json.loads(json.dumps(data)) # untouched copy for checkpoint
 	slicer_args = data.pop("slicer", {})
 	mask_args = data.pop("mask", {})
 	job_args = data.pop("job", {})
@@ -47,40 +73,39 @@ def start_tiled_upscale_job(data):
 		except Exception as e:
 			return web.Response(status=403, text=f"403\n{e}")
 
-		# todo: not this
+		# only reads the header, decoding happens in load_canvas
 		from PIL import Image
-		from core.utils import sanitize, channel_fix
-		image = channel_fix(sanitize(Image.open(path)))
+		img = Image.open(path)
 
 		# resize - check args
 		if not ("image_height" in job_args and "image_width" in job_args):
 			if "image_scale" in job_args:
-				job_args["image_height"] = int(image.shape[2]*job_args["image_scale"])
-				job_args["image_width"] = int(image.shape[3]*job_args["image_scale"])
+				job_args["image_height"] = int(img.height*job_args["image_scale"])
+				job_args["image_width"] = int(img.width*job_args["image_scale"])
 			else:
 				job_args["image_scale"] = 1.0
-				job_args["image_height"] = image.shape[2]
-				job_args["image_width"] = image.shape[3]
+				job_args["image_height"] = img.height
+				job_args["image_width"] = img.width
 		if "image_scale" not in job_args:
-			job_args["image_scale"] = job_args["image_height"]/image.shape[2]
-
-		# apply input resize - if required
-		if job_args["image_scale"] != 1.0:
-			image = torch.nn.functional.interpolate(
-				image,
-				size = (
-					job_args["image_height"],
-					job_args["image_width"],
-				),
-				mode = "bilinear"
-			)
-		
-		# crop to align to multiples of 8
-		image = image[:, :, :(image.shape[2] - image.shape[2]%8), :(image.shape[3] - image.shape[3]%8)]
-		
+			job_args["image_scale"] = job_args["image_height"]/img.height
+
+		# final shapes (always 3 channels, cropped to multiples of 8)
+		src_shape = (1, 3, img.height, img.width)
+		if job_args["image_scale"] == 1.0:
+			job_args["image_height"] = img.height
+			job_args["image_width"] = img.width
+		shape = (1, 3, job_args["image_height"] - job_args["image_height"]%8, job_args["image_width"] - job_args["image_width"]%8)
+
 	else:
 		return web.Response(status=400, text=f"400\nMissing 'image_name' or 'image_data' in request!")
 
+	# resume - cheap check before anything is decoded, tile geometry is checked once the slicer exists
+	if checkpoint is not None:
+		try:
+			checkpoint.verify(shape=shape, upscale_factor=job_args.get("upscale_factor", 1.0))
+		except ValueError as e:
+			return web.Response(status=400, text=f"400\n{e}")
+
 	# Workers
 	if job_args.get("dry_run", False):
 		job_workers = []
@@ -101,10 +126,36 @@ def start_tiled_upscale_job(data):
 	if "size" not in slicer_args:
 		slicer_args["size"] = 768
 		log("Falling back to default tile size of 768!", "warning")
-	slicer = get_slicer(**slicer_args, image=image)
 
 	# Mask
 	mask = MaskBuilder(**mask_args)
+	if job_args.get("canvas_dtype", "float32") not in CANVAS_DTYPES:
+		return web.Response(status=400, text=f"400\nUnknown canvas dtype '{job_args['canvas_dtype']}'!")
+	if job_args.get("canvas_backend", "memory") not in CANVAS_BACKENDS:
+		return web.Response(status=400, text=f"400\nUnknown canvas backend '{job_args['canvas_backend']}'!")
+	if job_args.get("resize_mode", "bicubic") not in RESIZE_KERNELS:
+		return web.Response(status=400, text=f"400\nUnknown resize mode '{job_args['resize_mode']}'!")
+	if job_args.get("compositor", "mask") not in COMPOSITOR_DICT:
+		return web.Response(status=400, text=f"400\nUnknown compositor '{job_args['compositor']}'!")
+
+	# Region of interest (partial re-render on top of a previous output)
+	base_img = None
+	region_img = None
+	if "region" in job_args or "region_mask_name" in job_args:
+		if "base_name" not in job_args:
+			return web.Response(status=400, text="400\nRegion re-render requires 'base_name' (previous output)!")
+		if job_args.get("compositor", "mask") != "mask":
+			return web.Response(status=400, text="400\nRegion re-render only works with mask compositing!")
+		try:
+			base_img = open_job_image(job_args.get("base_mode", "output"), job_args["base_name"])
+			if "region_mask_name" in job_args:
+				region_img = open_job_image(job_args.get("region_mask_mode", "input"), job_args["region_mask_name"])
+			elif len(job_args["region"]) != 4:
+				raise ValueError("Region must be [h_start, h_end, w_start, w_end]!")
+		except ValueError as e:
+			return web.Response(status=403, text=f"403\n{e}")
+		except FileNotFoundError as e:
+			return web.Response(status=404, text=f"404\n{e}")
 
 	# Workflow
 	if "workflow" not in wf_args:
@@ -118,6 +169,57 @@ def start_tiled_upscale_job(data):
 		wf = increment_seed(wf, wf_args["seed_increment"])
 	job_args["workflow"] = wf
 
+	# only send tiles to workers that have all nodes/models
+	excluded = {}
+	if not job_args.get("dry_run", False):
+		job_workers, excluded = get_eligible_workers(wf, job_workers)
+		for worker_id, info in excluded.items():
+			log(f"Excluding worker {worker_id} [{info['name']}] from job: {', '.join(info['reasons'])}", "warning")
+		if not job_workers:
+			reasons = sorted(set(sum([x["reasons"] for x in excluded.values()], [])))
+			return web.Response(status=400, text=f"400\nNo worker can run this workflow! ({', '.join(reasons)})")
+
+	# optional global pre-pass (e.g. model upscale) before tiled sampling
+	prepass = None
+	if job_args.get("prepass"):
+		prepass = job_args["prepass"]
+		if not isinstance(prepass, dict) or not prepass.get("workflow"):
+			return web.Response(status=400, text="400\nPre-pass needs a workflow!")
+		# tiles have to see their finished neighbours with "out" (NyanTile), the pre-pass output can't be both
+		if job_args.get("tile_source", "raw") == "out":
+			return web.Response(status=400, text="400\nPre-pass can't be used with tile source 'out'!")
+		prepass["workflow"] = sanitize_workflow(prepass["workflow"])
+		try:
+			prepass["upscale_factor"] = float(prepass.get("upscale_factor", 1.0))
+			prepass["chunk_size"] = int(prepass.get("chunk_size", PREPASS_CHUNK))
+			assert prepass["upscale_factor"] > 0 and prepass["chunk_size"] >= 64
+		except (ValueError, TypeError, AssertionError):
+			return web.Response(status=400, text="400\nInvalid pre-pass upscale_factor/chunk_size!")
+		prepass_workers = job_workers
+		if not job_args.get("dry_run", False):
+			prepass_workers, prepass_excluded = get_eligible_workers(prepass["workflow"], job_workers)
+			for worker_id, info in prepass_excluded.items():
+				log(f"Excluding worker {worker_id} [{info['name']}] from pre-pass: {', '.join(info['reasons'])}", "warning")
+			if not prepass_workers:
+				return web.Response(status=400, text="400\nNo worker can run the pre-pass workflow!")
+		# workers aren't json serializable, keep them out of the metadata
+		prepass = {**prepass, "workers": prepass_workers}
+
+	# Memory budget (MiB) - downgrade canvas storage or reject job if it won't fit
+	mem_args = {"workers": max(len(job_workers), 1), "tile_size": slicer_args["size"]}
+	if job_args.get("memory_budget"):
+		budget = int(job_args["memory_budget"] * 1024**2)
+		fitted = fit_memory_budget(src_shape, shape, job_args, budget, **mem_args)
+		if fitted is None:
+			mem = estimate_job_memory(src_shape, shape, job_args, **mem_args)
+			return web.Response(status=400, text=f"400\nJob needs ~{mem['peak']/1024**2:.0f}MiB, over memory budget of {job_args['memory_budget']}MiB!")
+		for key in ["canvas_dtype", "canvas_backend"]:
+			if fitted[key] != job_args.get(key):
+				log(f"Memory budget: using {key}='{fitted[key]}'", "warning")
+		job_args.update(fitted)
+	job_memory = estimate_job_memory(src_shape, shape, job_args, **mem_args)
+	log(f"Projected peak memory for job: {job_memory['peak']/1024**2:.0f}MiB", "info")
+
 	# Raw workflow for UI compatibility
 	if "workflow_raw" in wf_args:
 		wfr = wf_args.pop("workflow_raw")
@@ -131,11 +233,150 @@ def start_tiled_upscale_job(data):
 	global current_job
 	if current_job is not None and not current_job.done():
 		return web.Response(status=400, text=f"400\nJob already running!")
-	job = TiledUpscaleJob(slicer, image, mask, job_workers, job_args, save=save)
+
+	# decode/resize straight into canvas storage (after all checks, this is the expensive part)
+	canvas_args = {
+		"height":  job_args["image_height"],
+		"width":   job_args["image_width"],
+		"dtype":   get_canvas_dtype(job_args.get("canvas_dtype", "float32")),
+		"backend": job_args.get("canvas_backend", "memory"),
+		"mode":    job_args.get("resize_mode", "bicubic"),
+	}
+	source = None
+	region = None
+	if base_img:
+		# previous output is the canvas, input is only needed as the raw tile source
+		image = load_canvas(base_img, **canvas_args)
+		if job_args.get("tile_source", "raw") == "raw":
+			source = load_canvas(img, **canvas_args)
+		if region_img:
+			canvas_args.update({"dtype": torch.uint8, "backend": "memory", "mode": "bilinear"})
+			region_mask = load_canvas(region_img, **canvas_args)[:, :1].contiguous()
+			region = RegionMask(image.shape, mask=region_mask, feather=job_args.get("region_feather", 0))
+		else:
+			region = RegionMask(image.shape, rect=job_args["region"], feather=job_args.get("region_feather", mask_args.get("feather", 0)))
+	else:
+		image = load_canvas(img, **canvas_args)
+	del img, base_img, region_img
+	slicer = get_slicer(**slicer_args, image=image)
+
+	# tile cache - skip for test runs since the output is fake
+	cache = None
+	if job_args.get("tile_cache", True) and not job_args.get("dry_run", False):
+		cache = get_tile_cache()
+
+	# checkpoint - opt-in, skipped for test runs
+	if checkpoint is None and job_args.get("checkpoint", False) and not job_args.get("dry_run", False):
+		checkpoint = new_checkpoint(request)
+	if checkpoint is not None:
+		try:
+			checkpoint.start(slicer, image.shape, job_args.get("upscale_factor", 1.0))
+		except ValueError as e:
+			return web.Response(status=400, text=f"400\n{e}")
+
+	job = TiledUpscaleJob(
+		slicer, image, mask, job_workers, job_args,
+		save = save,
+		cache = cache,
+		source = source,
+		region = region,
+		checkpoint = checkpoint,
+		prepass = prepass,
+	)
+	job.memory = job_memory
+	job.excluded = excluded
+	job.events = get_job_events()
 	current_job = job
 	current_job.start()
 	return web.Response(status=200)
 
+def start_job(data, checkpoint=None):
+	"""
+	Start job, serialized so concurrent requests can't both pass the "job running" check
+	"""
+	with start_lock:
+		return start_tiled_upscale_job(data, checkpoint=checkpoint)
+
+def get_job_status():
+	"""
+	Get status/progress/stats for the current (or last) job
+	"""
+	data = {}
+	# Idle
+	if current_job is None:
+		data["status"] = "idle"
+	elif current_job.done():
+		data["status"] = "idle"
+		if current_job.outputs:
+			data["output"] = current_job.outputs
+		elif current_job.previewer:
+			data["output"] = [{"mode":"preview", "name":None},]
+			data["preview_changed"] = int(current_job.previewer.changed)
+	# Processing
+	else:
+		data["status"] = "proc"
+		data["progress"] = current_job.get_progress()
+		if current_job.previewer:
+			data["preview_changed"] = int(current_job.previewer.changed)
+	# memory usage/tile cache stats for current/last job
+	if current_job is not None:
+		data["memory"] = current_job.get_memory_info()
+		data["queue"] = current_job.get_queue_info()
+		data["assembly"] = current_job.get_assembly_info()
+		if current_job.previewer:
+			data["preview"] = current_job.previewer.get_info()
+		if current_job.excluded:
+			data["excluded_workers"] = current_job.excluded
+		if current_job.warmup_times:
+			data["warmup"] = current_job.warmup_times
+		if current_job.prepass:
+			data["prepass"] = current_job.prepass.get_info()
+		if current_job.checkpoint:
+			data["checkpoint"] = current_job.checkpoint.name
+		if current_job.error:
+			data["error"] = current_job.error
+		if current_job.cache:
+			data["cache"] = {
+				"hits": current_job.cache_hits,
+				"misses": current_job.cache_misses,
+			}
+	return data
+
+async def stream_job_events(request):
+	"""
+	Push job events to the client until it disconnects.
+	"status" events are sent with the full job status, others as published by the job.
+	"""
+	response = web.StreamResponse(headers={
+		"Content-Type": "text/event-stream",
+		"Cache-Control": "no-cache",
+	})
+	await response.prepare(request)
+	events = get_job_events()
+	queue = events.subscribe()
+	try:
+		# initial state
+		await send_event(response, "status", get_job_status())
+		while True:
+			try:
+				event = await asyncio.wait_for(queue.get(), EVENT_KEEPALIVE)
+			except asyncio.TimeoutError:
+				await response.write(b": keepalive\n\n")
+				continue
+			data = get_job_status() if event["type"] == "status" else event["data"]
+			await send_event(response, event["type"], data)
+	except (ConnectionResetError, asyncio.CancelledError):
+		pass
+	finally:
+		events.unsubscribe(queue)
+	return response
+
+async def send_event(response, kind, data):
+	"""
+	Write single server-sent event
+	"""
+	await response.write(f"event: {kind}\ndata: {json.dumps(data)}\n\n".encode())
+
 async def exec_api(request):
 	"""
 	Switch for exec/abort logic
@@ -147,7 +388,38 @@ async def exec_api(request):
 		Start new job
 		"""
 		data = await request.json()
-		return start_tiled_upscale_job(data)
+		return await run_blocking(start_job, data)
+	elif request.method == "POST" and cmd == "resume":
+		"""
+		Resume job from checkpoint, only missing tiles are processed
+		"""
+		data = await request.json()
+		try:
+			checkpoint = load_checkpoint(data.get("name", ""))
+			request_data = checkpoint.get_request()
+		except FileNotFoundError as e:
+			return web.Response(status=404, text=f"404\n{e}")
+		except ValueError as e: # broken json
+			return web.Response(status=400, text=f"400\nInvalid checkpoint ({e})")
+		# image size/upscale factor/tile geometry are verified against the checkpoint before the job starts
+		return await run_blocking(start_job, request_data, checkpoint=checkpoint)
+	elif request.method == "GET" and cmd == "checkpoints":
+		"""
+		List resumable jobs
+		"""
+		return web.json_response(await run_blocking(list_checkpoints))
+	elif request.method == "POST" and cmd == "delete_checkpoint":
+		"""
+		Delete checkpoint (can't be resumed afterwards)
+		"""
+		data = await request.json()
+		if current_job and not current_job.done() and current_job.checkpoint and current_job.checkpoint.name == data.get("name"):
+			return web.Response(status=400, text="400\nCheckpoint is in use by the current job!")
+		try:
+			await run_blocking(delete_checkpoint, data.get("name", ""))
+		except FileNotFoundError as e:
+			return web.Response(status=404, text=f"404\n{e}")
+		return web.Response(status=200)
 	elif request.method == "POST" and cmd == "abort":
 		"""
 		Abort current job
@@ -160,51 +432,57 @@ async def exec_api(request):
 		"""
 		Get job status
 		"""
-		data = {}
-		# Idle
-		if current_job is None:
-			data["status"] = "idle"
-		elif current_job.done():
-			data["status"] = "idle"
-			if current_job.outputs:
-				data["output"] = current_job.outputs
-			elif current_job.previewer:
-				data["output"] = [{"mode":"preview", "name":None},]
-				data["preview_changed"] = int(current_job.previewer.changed)
-		# Processing
-		else:
-			data["status"] = "proc"
-			data["progress"] = {
-				"current": current_job.pbar.n,
-				"total": current_job.pbar.total,
-				"perc": round(current_job.pbar.n/current_job.pbar.total,2),
-			}
-			data["progress"]["label"] = current_job.pbar.format_meter(
-				current_job.pbar.n,
-				current_job.pbar.total,
-				current_job.pbar.format_dict.get("elapsed", 1),
-				ascii = True,
-				unit  = "Tile",
-				bar_format = "[{n_fmt}/{total_fmt} | {elapsed}&lt{remaining} | {rate_fmt}{postfix}]",
-			).replace("  "," ")
-			if current_job.previewer:
-				data["preview_changed"] = int(current_job.previewer.changed)
-		return web.json_response(data)
+		return web.json_response(get_job_status())
+	elif request.method == "GET" and cmd == "events":
+		"""
+		Stream job status/tile/preview events (server-sent events)
+		"""
+		return await stream_job_events(request)
 	elif request.method == "GET" and cmd == "preview":
 		"""
 		Get preview image
 		"""
-		if not current_job:
+		if not current_job or not current_job.previewer:
 			return web.Response(status=400, text=f"400\nNo active jobs")
-		# todo: definitely not this
-		from io import BytesIO
-		from PIL import Image
-		from torchvision.transforms.functional import to_pil_image
-		img = current_job.previewer.get_preview()
-		img = to_pil_image(img[0])
-		tmp = BytesIO()
-		img.save(tmp, "jpeg", subsampling=0, quality=99)
-		tmp.seek(0)
-		return web.Response(body=tmp.getvalue(), content_type='image/jpeg')
+		# optional overrides for the configured defaults
+		query = request.rel_url.query
+		fmt = query.get("format", preview_settings["format"])
+		if fmt not in PREVIEW_FORMATS:
+			return web.Response(status=400, text=f"400\nInvalid preview format '{fmt}'")
+		try:
+			quality = min(max(int(query.get("quality", preview_settings["quality"])), 1), 100)
+			size = max(int(query.get("size", preview_settings["size"])), 0)
+		except ValueError:
+			return web.Response(status=400, text="400\nInvalid preview quality/size")
+		# redraw/encode off the event loop, repeated polls at the same change return cached bytes
+		body = await run_blocking(current_job.previewer.get_encoded, fmt, quality, size)
+		return web.Response(body=body, content_type=PREVIEW_FORMATS[fmt])
 	else:
 		return web.Response(status=400, text=f"400\ninvalid request{cmd}")
+
+async def pyramid_api(request):
+	"""
+	Serve deep zoom pyramid of the current job output (DZI layout)
+	job.dzi: descriptor, job.json: same as json
+	job_files/{level}/{col}_{row}.{ext}: single tile
+	"""
+	if not current_job or not current_job.pyramid:
+		return web.Response(status=404, text="404\nNo active jobs")
+	pyramid = current_job.pyramid
+	fmt = preview_settings["format"]
+	name = request.match_info.get("name")
+	if name == "job.dzi":
+		return web.Response(text=pyramid.get_dzi(fmt), content_type="application/xml")
+	elif name == "job.json":
+		return web.json_response({**pyramid.get_info(), "format": fmt})
+	try:
+		base, level, tile = name.split("/")
+		col, row = tile.split(".")[0].split("_")
+		level, col, row = int(level), int(col), int(row)
+		assert base == "job_files"
+	except (ValueError, AssertionError):
+		return web.Response(status=400, text=f"400\nInvalid pyramid tile '{name}'")
+	body = await run_blocking(pyramid.get_encoded, level, col, row, fmt, preview_settings["quality"])
+	if body is None:
+		return web.Response(status=404, text="404\nPyramid tile out of range")
+	return web.Response(body=body, content_type=PREVIEW_FORMATS[fmt])
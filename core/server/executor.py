@@ -0,0 +1,111 @@
+#
+# Managed executor for blocking work in request handlers + event loop lag tracking
+#
+import time
+import asyncio
+from threading import Lock
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from ..utils import log
+
+EXECUTOR_THREADS = 8 # default size, see config.yaml
+LOOP_LAG_INTERVAL = 0.25 # seconds between loop lag samples
+LOOP_LAG_WARN = 0.5 # log loop stalls longer than this (seconds)
+
+executor = None
+stats_lock = Lock()
+stats = {
+	"threads": 0,
+	"submitted": 0,
+	"running": 0,
+	"completed": 0,
+	"failed": 0,
+	"time": 0.0, # total time spent in blocking calls
+	"wait": 0.0, # total time spent waiting for a free thread
+}
+loop_lag = {
+	"last": 0.0,
+	"max": 0.0,
+	"avg": 0.0, # exponential moving average
+	"samples": 0,
+}
+
+def init_executor(threads=EXECUTOR_THREADS):
+	"""
+	Initialize global executor (on startup)
+	"""
+	global executor
+	executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="LiliumExec")
+	stats["threads"] = threads
+	log(f"Blocking call executor: {threads} threads", "debug")
+
+def run_tracked(func, queued, *args, **kwargs):
+	"""
+	Run blocking function, update stats. Executor thread.
+	"""
+	start = time.time()
+	with stats_lock:
+		stats["running"] += 1
+		stats["wait"] += start - queued
+	ok = False
+	try:
+		out = func(*args, **kwargs)
+		ok = True
+		return out
+	finally:
+		with stats_lock:
+			stats["running"] -= 1
+			stats["completed" if ok else "failed"] += 1
+			stats["time"] += time.time() - start
+
+async def run_blocking(func, *args, **kwargs):
+	"""
+	Run blocking function in the managed executor without stalling the event loop
+	"""
+	if executor is None:
+		init_executor()
+	with stats_lock:
+		stats["submitted"] += 1
+	return await asyncio.get_running_loop().run_in_executor(
+		executor, partial(run_tracked, func, time.time(), *args, **kwargs)
+	)
+
+async def monitor_loop_lag(interval=LOOP_LAG_INTERVAL):
+	"""
+	Measure how late the event loop wakes up from a sleep, i.e. how long it was blocked for
+	"""
+	while True:
+		start = time.perf_counter()
+		await asyncio.sleep(interval)
+		lag = max(time.perf_counter() - start - interval, 0.0)
+		loop_lag["last"] = lag
+		loop_lag["max"] = max(loop_lag["max"], lag)
+		loop_lag["avg"] = lag if not loop_lag["samples"] else loop_lag["avg"]*0.95 + lag*0.05
+		loop_lag["samples"] += 1
+		if lag > LOOP_LAG_WARN:
+			log(f"Event loop was blocked for {lag:.2f}s", "warning")
+
+async def start_loop_monitor(app):
+	"""
+	aiohttp startup hook, start loop lag monitor
+	"""
+	app["loop_monitor"] = asyncio.create_task(monitor_loop_lag())
+
+def get_executor_info():
+	"""
+	Get executor stats and event loop lag (times in seconds)
+	"""
+	with stats_lock:
+		info = stats.copy()
+	info["queued"] = max(info["submitted"] - info["completed"] - info["failed"] - info["running"], 0)
+	info["time"] = round(info["time"], 3)
+	info["wait"] = round(info["wait"], 3)
+	return {
+		"executor": info,
+		"loop_lag": {
+			"last": round(loop_lag["last"]*1000, 1), # ms
+			"max": round(loop_lag["max"]*1000, 1),
+			"avg": round(loop_lag["avg"]*1000, 1),
+		},
+	}
@@ -13,6 +13,8 @@ from ..utils import log
 from ..path import get_base_path, get_new_path, get_absolute_path, get_relative_path, verify_extension
 from ..workflow import load_image_meta, get_prompt_text
 
+from .executor import run_blocking
+
 async def static_api(request):
 	"""
 	Handle static files from the web folder
@@ -61,7 +63,13 @@ async def upload_api(request):
 	Handle file uploads
 	"""
 	data = await request.post()
-	image = data["image"]
+	# hashing/decoding/writing the file would block the loop
+	return await run_blocking(save_upload, data["image"])
+
+def save_upload(image):
+	"""
+	Verify and save uploaded image to the input folder. Executor thread.
+	"""
 	meta = {}
 	raw = image.file.read()
 
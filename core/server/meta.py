@@ -8,9 +8,11 @@ from aiohttp import web
 
 from ..utils import log
 from ..path import get_base_path, get_absolute_path, get_relative_path, verify_extension
-from ..workflow import load_json, load_image_meta, sanitize_workflow, set_input_image, find_output_image_id, get_prompt_text, verify_nodes
+from ..workflow import load_json, load_image_meta, sanitize_workflow, set_input_image, find_output_image_id, get_prompt_text
+from ..capability import verify_workflow
 
 from .workers import get_workers
+from .executor import run_blocking, get_executor_info
 
 def get_workflow_info(path, workers=[]):
 	"""
@@ -44,10 +46,11 @@ def get_workflow_info(path, workers=[]):
 	positive_prompt = get_prompt_text(wf, "positive")
 	negative_prompt = get_prompt_text(wf, "negative")
 
-	# Verify that none of the changes caused incompatibilities (ignore debug/failed)
-	workers = [x for x in workers if x.state not in ["fail","lock"]]
+	# Verify that at least one worker can run it, list the ones that can't (ignore debug/failed)
+	workers = [x for x in workers if x.state not in ["fail","lock","init"]]
+	excluded = {}
 	if len(workers) > 0 and all(["Debug" not in str(type(x)) for x in workers]):
-		verify_nodes(wf, workers)
+		excluded = verify_workflow(wf, workers)
 
 	# build settings dict to return
 	return {
@@ -56,6 +59,7 @@ def get_workflow_info(path, workers=[]):
 		"output_image_id": out_id,
 		"positive_prompt": positive_prompt,
 		"negative_prompt": negative_prompt,
+		"excluded_workers": excluded,
 	}
 
 def list_all_workflows():
@@ -77,7 +81,7 @@ def list_all_workflows():
 async def meta_api(request):
 	cmd = request.match_info.get("command")
 	if cmd == "workflow_list":
-		return web.json_response(list_all_workflows())
+		return web.json_response(await run_blocking(list_all_workflows))
 	elif cmd in ["workflow", "image"]:
 		# check args/input
 		if "name" not in request.rel_url.query:
@@ -93,7 +97,7 @@ async def meta_api(request):
 		# formatted workflow
 		if cmd == "workflow":
 			try:
-				data = get_workflow_info(path, workers=get_workers())
+				data = await run_blocking(get_workflow_info, path, workers=get_workers())
 				return web.json_response(data)
 			except Exception as e:
 				log(f"Failed to load workflow for {name}: {e}", "error")
@@ -102,12 +106,15 @@ async def meta_api(request):
 		# raw metadata
 		if cmd == "image":
 			try:
-				data = load_image_meta(path)
+				data = await run_blocking(load_image_meta, path)
 				return web.json_response(data)
 			except Exception as e:
 				log(f"Failed to load metadata for {name}: {e}", "error")
 				return web.Response(status=400, text=f"400\n{e}")
 
 		return web.Response(status=404)
+	elif cmd == "server":
+		# blocking call executor load + event loop responsiveness
+		return web.json_response(get_executor_info())
 	else:
 		return web.Response(status=404)
@@ -1,15 +1,27 @@
 #
 # Worker handling
 #
+import time
 import asyncio
 import aiohttp
 from aiohttp import web
+from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor
 
+from ..utils import log
 from ..worker import ComfyUIWorker, DebugWorker
+from ..capability import CAPABILITY_REFRESH
+
+from .executor import run_blocking
 
 workers = [] # list of workers for server
 worker_class = ComfyUIWorker
 
+WORKER_REFRESH = 5.0 # seconds between background worker status refreshes
+WORKER_REFRESH_THREADS = 16 # max. workers polled at once
+snapshot = {} # worker_id => {"info", "updated", "error"}
+snapshot_lock = Lock()
+
 def set_worker_class(mode):
 	"""
 	Allow setting 
@@ -24,20 +36,103 @@ def set_worker_class(mode):
 
 def init_workers(config):
 	"""
-	Initialize workers from config file (on startup)
+	Initialize workers from config file (on startup).
+	Returns right away, workers connect in the background and go from "init" to "idle"/"fail".
 	"""
 	global workers
-	workers = [worker_class(**x) for x in config]
+	workers = [worker_class(**x, connect=False) for x in config]
+	Thread(target=connect_workers, args=(workers.copy(),), daemon=True).start()
+
+def connect_workers(to_init):
+	"""
+	Connect to all workers concurrently. Separate thread.
+	"""
+	def connect(worker):
+		start = time.time()
+		state = worker.init()
+		log(f"Worker {worker.worker_id} [{worker.name}] {state} after {time.time()-start:.2f}s", "debug")
+
+	start = time.time()
+	if to_init:
+		with ThreadPoolExecutor(max_workers=min(len(to_init), WORKER_REFRESH_THREADS), thread_name_prefix="LiliumWorkerInit") as pool:
+			[x.result() for x in [pool.submit(connect, w) for w in to_init]]
+	ready = len([x for x in to_init if x.state == "idle"])
+	log(f"Startup: workers connected in {time.time()-start:.2f}s ({ready}/{len(to_init)} ready)", "info")
 
 def get_workers(excluse_failed=True):
 	"""
 	Return list of available workers
 	"""
 	if excluse_failed:
-		return [x for x in workers if x.state not in ["fail","lock"]]
+		return [x for x in workers if x.state not in ["fail","lock","init"]]
 	else:
 		return workers
 
+def refresh_worker(worker):
+	"""
+	Poll single worker and store result in the snapshot. Blocking (HTTP request).
+	"""
+	if worker.state == "init": # still connecting
+		return
+	error = None
+	try:
+		worker.parse_status(force=True)
+		# node/model index, only every few minutes since object_info is large
+		if worker.state not in ["fail", "lock"] and time.time() - worker.capability_updated > CAPABILITY_REFRESH:
+			worker.parse_models()
+	except Exception as e:
+		error = str(e)
+		log(f"Failed to refresh status for {worker.worker_id} ({e})", "debug")
+	entry = {"info": worker.get_info(), "updated": time.time(), "error": error}
+	with snapshot_lock:
+		snapshot[worker.worker_id] = entry
+
+def refresh_workers_loop(interval=WORKER_REFRESH):
+	"""
+	Poll all workers concurrently every interval, so requests never wait on a worker. Separate thread.
+	"""
+	with ThreadPoolExecutor(max_workers=WORKER_REFRESH_THREADS, thread_name_prefix="LiliumWorkerRefresh") as pool:
+		while True:
+			start = time.time()
+			# a slow worker only holds up its own entry, next round starts once all are done
+			[x.result() for x in [pool.submit(refresh_worker, w) for w in list(workers)]]
+			time.sleep(max(interval - (time.time() - start), 0.1))
+
+def start_worker_refresh(interval=WORKER_REFRESH):
+	"""
+	Start background worker status refresh (on startup)
+	"""
+	Thread(target=refresh_workers_loop, args=(interval,), daemon=True).start()
+	log(f"Refreshing worker status every {interval}s", "debug")
+
+def get_worker_info():
+	"""
+	Get info about all workers from the last snapshot. Non-blocking.
+	stale: seconds since the worker was last polled, None if it never was
+	"""
+	now = time.time()
+	with snapshot_lock:
+		entries = snapshot.copy()
+	info = []
+	sort = sorted([x for x in workers if x.state not in ["fail","lock","init"]])
+	for worker in sorted(workers):
+		nfo = {}
+		if worker in sort:
+			nfo["order"] = sort.index(worker)+1 # no 1, no 2 etc..
+		entry = entries.get(worker.worker_id)
+		if entry:
+			nfo.update(entry["info"])
+			nfo["state"] = worker.state # local, always current
+			nfo["updated"] = entry["updated"]
+			nfo["stale"] = round(now - entry["updated"], 1)
+			nfo["error"] = entry["error"]
+		else:
+			nfo.update(worker.get_info())
+			nfo["updated"] = None
+			nfo["stale"] = None
+		info.append(nfo)
+	return info
+
 async def worker_api(request):
 	"""
 	Handle worker related ops
@@ -48,16 +143,7 @@ async def worker_api(request):
 		"""
 		Get info about all active workers
 		"""
-		info = []
-		sort = sorted([x for x in workers if x.state not in ["fail","lock"]])
-		for worker in sorted(workers):
-			worker.parse_status()
-			nfo = {}
-			if worker in sort:
-				nfo["order"] = sort.index(worker)+1 # no 1, no 2 etc..
-			nfo.update(worker.get_info())
-			info.append(nfo)
-		return web.json_response(info)
+		return web.json_response(get_worker_info())
 	elif cmd == "add":
 		"""
 		Add worker (if doesn't exist)
@@ -74,7 +160,7 @@ async def worker_api(request):
 				worker_args["key"] = data["key"]
 
 		# create & append worker
-		worker = worker_class(**worker_args)
+		worker = await run_blocking(worker_class, **worker_args)
 		# todo: duplicates
 		workers.append(worker)
 		return web.Response(status=200)
@@ -4,7 +4,7 @@
 import torch
 import torchvision.transforms.functional as F
 
-from .utils import sanitize
+from .utils import sanitize, to_float, from_float
 
 class Tile:
 	"""
@@ -41,28 +41,41 @@ class Tile:
 			return True
 		return False
 
-	def crop(self, t, scale=1.0):
+	def overlaps(self, other):
+		"""
+		Check if the tile shares any pixels with another tile
+		"""
+		return (
+			self.h_start < other.h_end and other.h_start < self.h_end and
+			self.w_start < other.w_end and other.w_start < self.w_end
+		)
+
+	def crop(self, t, scale=1.0, clone=True):
 		"""
 		Crop any tensor to the tile coordinates w/ scaling
+		scale: coordinate scale, single value or (height, width) pair
+		clone: return a copy instead of a view on the original tensor
 		"""
-		h_start = round(self.h_start*scale)
-		h_end   = round(self.h_end*scale)
-		w_start = round(self.w_start*scale)
-		w_end   = round(self.w_end*scale)
+		scale_h, scale_w = scale if isinstance(scale, tuple) else (scale, scale)
+		h_start = round(self.h_start*scale_h)
+		h_end   = round(self.h_end*scale_h)
+		w_start = round(self.w_start*scale_w)
+		w_end   = round(self.w_end*scale_w)
 
 		dims = len(t.shape)
 		if dims == 3:
-			return t[:, h_start:h_end, w_start:w_end].clone()
+			t = t[:, h_start:h_end, w_start:w_end]
 		elif dims == 4:
-			return t[:, :, h_start:h_end, w_start:w_end].clone()
+			t = t[:, :, h_start:h_end, w_start:w_end]
 		else:
 			raise ValueError(f"Can't crop this shape '{t.shape}'")
+		return t.clone() if clone else t
 
 	def get(self, image, scale=1.0):
 		"""
-		Crop tile from image
+		Crop tile from image, always returned as a float32 copy
 		"""
-		return self.crop(sanitize(image), scale)
+		return to_float(self.crop(sanitize(image), scale, clone=False), copy=True)
 
 	def put(self, image, tile, mask=None, blend=1.0, scale=1.0):
 		"""
@@ -71,24 +84,11 @@ class Tile:
 		mask: mask for recombine: 0.0=image|1.0=tile
 		blend: mix in parts of original image
 		scale: scale coordinates when pasting. NOT the image.
+		! blends in place on the image, no full-size temporaries
 		"""
 		image = sanitize(image)
 		tile = sanitize(tile)
 
-		if torch.is_tensor(mask):
-			mask = sanitize(mask).to(tile.dtype)
-			raw = self.crop(image, scale)
-			# match mask shape to tile shape
-			if mask.shape != tile.shape:
-				mask = F.resize(mask, tile.shape[2:], antialias=True)
-			# match original to new tile shape
-			if raw.shape != tile.shape:
-				raw = F.resize(raw, tile.shape[2:], antialias=True)	
-			# combine original with processed using mask
-			pos_mask = mask * blend
-			neg_mask = torch.ones_like(pos_mask) - pos_mask
-			tile = tile * pos_mask + raw * neg_mask
-
 		# scale coordinates as required
 		h_start = round(self.h_start*scale)
 		h_end   = round(self.h_end*scale)
@@ -100,8 +100,27 @@ class Tile:
 		# full[:, :, :tile.shape[2], :tile.shape[3]] = tile
 		# tile = full
 
+		# view of the target region on the full image
+		view = image[:, :, h_start:h_end, w_start:w_end]
+		if view.shape != tile.shape:
+			tile = F.resize(tile, view.shape[2:], antialias=True)
+
+		if torch.is_tensor(mask):
+			mask = sanitize(mask).to(tile.dtype)
+			# match mask shape to tile shape
+			if mask.shape != tile.shape:
+				mask = F.resize(mask, tile.shape[2:], antialias=True)
+			if blend != 1.0:
+				mask = mask * blend
+			# reduced precision canvas - blend a float copy of the region only
+			raw = view if view.dtype == tile.dtype else to_float(view)
+			# combine original with processed using mask (raw + mask*(tile-raw))
+			raw.lerp_(tile, mask)
+		else:
+			raw = tile
 		# paste tile back onto full image
-		image[:, :, h_start:h_end,w_start:w_end] = tile
+		if raw is not view:
+			view.copy_(from_float(raw, view.dtype))
 		return image
 
 	def __str__(self):
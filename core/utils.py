@@ -1,6 +1,8 @@
 #
 # Extra/misc functions
 #
+import os
+import sys
 import torch
 import torchvision.transforms.functional as F
 from tqdm import tqdm
@@ -38,13 +40,83 @@ def channel_fix(t, channels=3):
 		pass
 	elif ch == 3 and channels == 4: # Missing alpha channel
 		# t = torch.cat([t, t[:, :1], dim=1)
-		t = torch.cat([t, torch.ones(t.shape[0], 1, t.shape[2],t.shape[3])], dim=1)
+		alpha = 255 if t.dtype == torch.uint8 else 1.0
+		t = torch.cat([t, torch.full((t.shape[0], 1, t.shape[2],t.shape[3]), alpha, dtype=t.dtype)], dim=1)
 	elif ch == 4 and channels == 3: # Extra alpha channel
 		t = t[:, :3]
 	else:
 		raise ValueError(f"Invalid mask channel count '{t.shape}'!")
 	return t
 
+### Canvas storage related functions ###
+CANVAS_DTYPES = {
+	"float32": torch.float32,
+	"float16": torch.float16,
+	"uint8":   torch.uint8,
+}
+
+def get_canvas_dtype(name):
+	"""
+	Get torch dtype for canvas storage from name
+	"""
+	assert name in CANVAS_DTYPES, f"Invalid canvas dtype '{name}'!"
+	return CANVAS_DTYPES[name]
+
+def to_float(t, copy=False):
+	"""
+	Convert image stored in any canvas dtype to float32 [0,1].
+	copy: always return a new tensor, even if no conversion is required
+	"""
+	if t.dtype == torch.uint8:
+		return t.to(torch.float32).div_(255.0)
+	if t.dtype == torch.float32:
+		return t.clone() if copy else t
+	return t.to(torch.float32)
+
+def from_float(t, dtype):
+	"""
+	Convert float [0,1] image to canvas dtype. Rounds for integer types.
+	"""
+	if dtype == torch.uint8:
+		return t.mul(255.0).round_().clamp_(0.0, 255.0).to(torch.uint8)
+	return t.to(dtype)
+
+def to_dtype(t, dtype):
+	"""
+	Convert image between canvas dtypes (no-op if it already matches)
+	"""
+	if t.dtype == dtype:
+		return t
+	return from_float(to_float(t), dtype)
+
+def get_peak_rss():
+	"""
+	Get peak resident memory over the whole process lifetime in bytes. Never resets.
+	None if not supported (windows).
+	"""
+	try:
+		import resource
+	except ImportError:
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return peak if sys.platform == "darwin" else peak*1024
+
+def get_current_rss():
+	"""
+	Get current resident memory of the process in bytes. None if not supported.
+	"""
+	try:
+		with open("/proc/self/statm") as f:
+			return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+	except (OSError, ValueError, AttributeError):
+		pass
+	# optional, only needed where /proc isn't available
+	try:
+		import psutil
+	except ImportError:
+		return None
+	return psutil.Process().memory_info().rss
+
 
 ### Log related functions ###
 LOGLEVELS = {
@@ -16,7 +16,8 @@ from urllib.error import URLError
 from torchvision.transforms.functional import to_pil_image
 
 from .utils import sanitize, log
-from .workflow import format_workflow_path, set_input_image, set_prompt_text, find_output_image_id
+from .workflow import format_workflow_path, set_input_image, set_prompt_text, find_output_image_id, NODES_WITH_PATH
+from .capability import build_capabilities, save_capabilities, load_capabilities, AnySet, MODEL_INPUTS
 
 TIMEOUT = 8
 MAX_FAILURES = 1000
@@ -26,7 +27,13 @@ class ComfyUIWorker:
 	"""
 	Main class for ComfyUI backend
 	"""
-	def __init__(self, url, priority=1.0, name=None):
+	def __init__(self, url, priority=1.0, name=None, connect=True):
+		"""
+		url: ComfyUI instance URL
+		priority: higher is picked first
+		name: display name, defaults to the GPU name
+		connect: load info from the remote right away, otherwise stays in "init" until init() is called
+		"""
 		url = urlparse(url)
 		self.url = f"{url.scheme}://{url.netloc}"
 		self.host = url.hostname
@@ -34,20 +41,31 @@ class ComfyUIWorker:
 		self.worker_id = url.netloc # should be unique enough
 		self.priority = priority
 		self.priority_init = priority
-		# Can be "idle", "proc", "fail", "lock"
+		# Can be "init", "idle", "proc", "fail", "lock"
 		self.state = "init"
 		self.state_old = "init"
 		self.fails = 0
 		self.lock = Lock()
+		self.name_init = name
+		self.name = name or self.worker_id # placeholder until init
 
+		if connect:
+			self.init()
+
+	def init(self):
+		"""
+		Load info from the remote and move from "init" to "idle" (or "fail"). Blocking.
+		"""
 		try:
-			self.parse()
-			self.name = name or f"{self.gpu}"
+			# node/model index is refreshed in the background later on
+			self.parse(cached=True)
+			self.name = self.name_init or f"{self.gpu}"
 			self.state = "idle"
 		except Exception as e:
-			self.name = "Unknown"
+			self.name = self.name_init or "Unknown"
 			self.state = "fail"
 			log(f"Worker init. failed for {self.worker_id}", "warning")
+		return self.state
 
 	def request(self, endpoint, timeout=TIMEOUT):
 		"""
@@ -72,15 +90,16 @@ class ComfyUIWorker:
 			# if self.gpu.startswith(prefix):
 				# self.gpu = self.gpu[len(prefix):]
 
-	def parse_status(self):
+	def parse_status(self, force=False):
 		"""
 		Try to load/update dynamic info about remote worker.
+		force: poll even if the state hasn't changed (background refresh)
 		"""
 		# don't try to check client we know is failed/locked
 		if self.state in ["fail", "lock"]:
 			return
 		# don't poll remote if state hasn't changed
-		if self.state == self.state_old:
+		if self.state == self.state_old and not force:
 			return
 		else:
 			self.state_old = self.state
@@ -89,37 +108,40 @@ class ComfyUIWorker:
 		self.vram_free = round(data["devices"][0]["vram_free"] / 1024**3, 2)
 		self.vram_perc = round(1.0 - data["devices"][0]["vram_free"] / data["devices"][0]["vram_total"], 2)
 
-	def parse_models(self):
+	def parse_models(self, cached=False):
 		"""
-		Get list of available models/LoRAs/etc.
+		Get list of available nodes/models/LoRAs/etc.
+		cached: reuse the index stored on disk if there is one (startup)
 		"""
-		data = self.request("object_info")
-		self.models = {
-			"checkpoint": data["CheckpointLoaderSimple"]["input"]["required"]["ckpt_name"][0],
-			"loras": data["LoraLoader"]["input"]["required"]["lora_name"][0],
-			"vae": data["VAELoader"]["input"]["required"]["vae_name"][0],
-			"controlnet": data["ControlNetLoader"]["input"]["required"]["control_net_name"][0],
-			"upscale_models": data["UpscaleModelLoader"]["input"]["required"]["model_name"][0],
-		}
-		# replace windows os.sep with linux version to allow comparison
-		for key,val in self.models.items():
-			out = []
-			for name in val:
-				if "/" in name and "\\" in name:
-					log(f"Model name contains both `\\\\` and `/` '{name}'!", "warning")
-				name = name.replace('\\','/')
-				out.append(name)
-			self.models[key] = out
-		# save the object info for workflow parsing
-		self.object_info = data
-
-	def parse(self):
+		caps = load_capabilities(self.worker_id) if cached else None
+		if caps is None:
+			caps = build_capabilities(self.request("object_info"))
+			if caps["hash"] != getattr(self, "capability_hash", None):
+				if getattr(self, "capability_hash", None):
+					log(f"Nodes/models changed on worker {self.worker_id}", "info")
+				save_capabilities(self.worker_id, caps)
+		else:
+			log(f"Using cached nodes/models for worker {self.worker_id}", "debug")
+		self.set_capabilities(caps)
+
+	def set_capabilities(self, caps):
+		"""
+		Apply capability index (see capability.py)
+		"""
+		self.nodes = set(caps["nodes"])
+		self.models = caps["models"]
+		self.paths = {k:set(v) for k,v in caps["paths"].items()}
+		self.capability_hash = caps["hash"]
+		self.capability_updated = caps["updated"]
+
+	def parse(self, cached=False):
 		"""
 		Load/refresh all stored info about client.
+		cached: use node/model index from disk if available, see parse_models
 		"""
 		self.parse_system_info()
 		self.parse_status()
-		self.parse_models()
+		self.parse_models(cached=cached)
 
 	def fail(self):
 		"""
@@ -166,7 +188,7 @@ class ComfyUIWorker:
 			"state": self.state,
 			"priority": self.priority,
 		}
-		if self.state != "fail":
+		if self.state not in ["fail", "init"]:
 			info.update({
 				"system_stats": {
 					"gpu" : self.gpu,
@@ -284,15 +306,22 @@ class ComfyUIWorker:
 		"""
 		Process one single image using the provided settings
 		"""
-		assert "workflow" in settings,"Missing workflow!"
+		assert "workflow" in settings or "workflow_template" in settings,"Missing workflow!"
 		with self.lock:
 			assert self.state == "idle",f"Incorrect worker state for processing '{self.state}'"
 			self.state = "proc"
 
-		# format workflow
-		wf = deepcopy(settings.pop("workflow"))
-		wf = format_workflow_path(wf, self.os)
-		wf = set_input_image(wf, f"LiliumSD-{self.port}.png")
+		# format workflow - precompiled per job if possible
+		if settings.get("workflow_template"):
+			template = settings.pop("workflow_template")
+			settings.pop("workflow", None)
+			wf = template.get(worker_os=self.os, input_name=f"LiliumSD-{self.port}.png")
+			output_id = template.output_id
+		else:
+			wf = deepcopy(settings.pop("workflow"))
+			wf = format_workflow_path(wf, self.os)
+			wf = set_input_image(wf, f"LiliumSD-{self.port}.png")
+			output_id = find_output_image_id(wf)
 
 		# upload image if it exists
 		if torch.is_tensor(image):
@@ -317,7 +346,7 @@ class ComfyUIWorker:
 		# execute workflow and get result
 		try:
 			job_id = self.run_workflow(wf)
-			out = self.download_image(job_id, find_output_image_id(wf))
+			out = self.download_image(job_id, output_id)
 		except Exception as e:
 			self.state = "idle"
 			self.fail()
@@ -357,7 +386,7 @@ class DebugWorker(ComfyUIWorker):
 		with self.lock:
 			self.state = "idle"
 		return image
-	def parse(self):
+	def parse(self, cached=False):
 		"""
 		set everything to to placeholder values.
 		"""
@@ -366,17 +395,19 @@ class DebugWorker(ComfyUIWorker):
 		self.vram = 1.0
 		self.vram_free = 0.5
 		self.vram_perc = 0.5
-		self.object_info = {}
-		self.models = {
-			"checkpoints": ["Demo"],
-			"loras": ["Demo"],
-			"vae": ["Demo"],
-			"controlnet": ["Demo"],
-			"upscale_models": ["Demo"],
-		}
+		self.set_capabilities({
+			"nodes": [],
+			"models": {k:["Demo"] for k in MODEL_INPUTS},
+			"paths": {k:[] for k in NODES_WITH_PATH},
+			"hash": None,
+			"updated": time.time(),
+		})
+		# fake worker can run any node/model, goes through the same checks as real ones
+		self.nodes = AnySet()
+		self.paths = {k:AnySet() for k in NODES_WITH_PATH}
 	def clear_queue(self):
 		pass
-	def parse_status(self):
+	def parse_status(self, force=False):
 		pass
 	def reset(self):
 		pass
@@ -4,6 +4,8 @@
 import os
 import json
 from PIL import Image
+from copy import deepcopy
+from threading import Lock
 
 from .utils import log
 from .path import get_base_path, get_absolute_path, get_relative_path, verify_extension
@@ -222,18 +224,24 @@ def increment_seed(wf, amount):
 	"""
 	return wf
 
-def verify_nodes(wf, workers):
+def get_warmup_workflow(wf, size=64):
 	"""
-	Verify all nodes actually exist on all workers.
+	Get cheap version of the workflow that still loads all models: one sampling step, tiny latents.
 	"""
-	# get a list of the nodes that are present on all workers.
-	nodes = set(sum([list(getattr(x, "object_info", {}).keys()) for x in workers], []))
-	# iterate all nodes and make sure they're available
+	wf = deepcopy(wf)
 	for node in wf.values():
-		if not node.get("class_type") in nodes:
-			raise ValueError(f"Node '{node.get('class_type')}' missing on one or more workers!")
-	log("All nodes present on all workers", "debug")
-	return
+		inputs = node.get("inputs", {})
+		# only touch values set directly, not ones linked from other nodes
+		if isinstance(inputs.get("steps"), int):
+			inputs["steps"] = 1
+		if isinstance(inputs.get("start_at_step"), int):
+			inputs["start_at_step"] = 0
+		if isinstance(inputs.get("end_at_step"), int):
+			inputs["end_at_step"] = 1
+		for key in ["width", "height"]:
+			if isinstance(inputs.get(key), int):
+				inputs[key] = size
+	return wf
 
 # nodes that have a path attribute
 NODES_WITH_PATH = {
@@ -304,3 +312,43 @@ def sanitize_workflow(wf):
 	wf = remove_node_attribute(wf, "is_changed")
 
 	return wf
+
+class WorkflowTemplate:
+	"""
+	Workflow compiled once per job. Node IDs are looked up once, paths are formatted once per worker OS.
+	Per-tile workflows are shallow copies with only the changed nodes copied.
+	"""
+	def __init__(self, wf):
+		"""
+		wf: final (sanitized, prompts set) workflow for the job, not modified
+		"""
+		self.wf = wf
+		self.input_id = find_input_image_id(wf)
+		self.output_id = find_output_image_id(wf)
+		self.compiled = {} # worker os => formatted workflow
+		self.lock = Lock()
+
+	def get_base(self, worker_os):
+		"""
+		Get workflow with path separators for the target OS. Shared, don't modify.
+		"""
+		with self.lock:
+			if worker_os not in self.compiled:
+				self.compiled[worker_os] = format_workflow_path(deepcopy(self.wf), worker_os)
+			return self.compiled[worker_os]
+
+	def get(self, worker_os, input_name=None):
+		"""
+		Get workflow for a single run
+		worker_os: worker OS, see format_workflow_path
+		input_name: input image name on the worker
+		"""
+		wf = dict(self.get_base(worker_os))
+		def patch(node_id, key, value):
+			node = dict(wf[node_id])
+			node["inputs"] = dict(node["inputs"])
+			node["inputs"][key] = value
+			wf[node_id] = node
+		if self.input_id and input_name:
+			patch(self.input_id, "image", input_name)
+		return wf
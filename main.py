@@ -2,19 +2,23 @@
 # Contains most API/server code. [Might be moved to dedicated file later.]
 #
 import os
+import time
 import yaml
 import asyncio
 import aiohttp
 import argparse
 from aiohttp import web
 
-from core.path import get_root_dir, set_base_path, set_default_base_paths
+from core.path import get_root_dir, get_base_path, set_base_path, set_default_base_paths
+from core.cache import init_tile_cache
+from core.preview import set_preview_settings
 from core.utils import log, get_available_loglevels, set_max_loglevel
 
 from core.server.meta import meta_api
 from core.server.files import static_api, media_api, upload_api
-from core.server.workers import worker_api, set_worker_class, init_workers, get_workers
-from core.server.control import exec_api
+from core.server.workers import worker_api, set_worker_class, init_workers, get_workers, start_worker_refresh, WORKER_REFRESH
+from core.server.control import exec_api, pyramid_api
+from core.server.executor import init_executor, start_loop_monitor, EXECUTOR_THREADS
 
 def parse_args():
 	"""
@@ -29,7 +33,15 @@ def parse_args():
 	args = parser.parse_args()
 	return args
 
+def log_phase(name, start):
+	"""
+	Log duration of a startup phase, returns start time for the next one
+	"""
+	log(f"Startup: {name} in {time.time()-start:.2f}s", "info")
+	return time.time()
+
 if __name__ == "__main__":
+	startup = phase = time.time()
 	# Parse CLI args
 	args = parse_args()
 
@@ -43,19 +55,40 @@ if __name__ == "__main__":
 	# Initialize folders
 	set_default_base_paths()
 	set_base_path("web", os.path.join(get_root_dir(), "web"), create=False, initial=True)
+	phase = log_phase("config/folders", phase)
+
+	# Initialize tile cache (size in MiB, 0 to disable)
+	init_tile_cache(
+		os.path.join(get_base_path("temp"), "cache"),
+		int(conf.get("tile_cache_mb", 2048)) * 1024**2,
+	)
+	phase = log_phase("tile cache", phase)
+
+	# Preview encoding defaults
+	set_preview_settings(**conf.get("preview", {}))
+
+	# Thread pool for blocking work in request handlers
+	init_executor(int(conf.get("executor_threads", EXECUTOR_THREADS)))
 
-	# Initialize workers
+	# Initialize workers - connects in the background, server starts right away
 	set_worker_class(args.backend)
 	init_workers(conf["workers"])
+	start_worker_refresh(float(conf.get("worker_refresh", WORKER_REFRESH)))
+	phase = log_phase("workers (connecting in background)", phase)
 
 	# Setup args
 	app = web.Application(client_max_size=150*1024*1024)
+	app.on_startup.append(start_loop_monitor)
+	async def log_ready(app):
+		log_phase("server ready", startup)
+	app.on_startup.append(log_ready)
 	app.add_routes([
 		web.get("/media/{mode}/{name:.*}", media_api),
 		web.get("/api/workers/{command}", worker_api),
 		web.get("/api/meta/{command}", meta_api),
 		web.get("/api/exec/{command}", exec_api),
 		web.post("/api/exec/{command}", exec_api),
+		web.get("/api/pyramid/{name:.*}", pyramid_api),
 		web.post("/api/upload", upload_api),
 		web.get("/", static_api),
 		web.get("/{name:.*}", static_api), # default
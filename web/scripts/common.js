@@ -13,6 +13,7 @@ document.addEventListener("DOMContentLoaded", function() {
 	update_available_workflows()
 	image_size_update()
 	tiling_settings_update(document.getElementsByClassName("tiling-name")[0])
+	start_status_stream()
 	update_status_timer = setInterval(update_status_loop, 1000);
 
 	// drag and drop listener
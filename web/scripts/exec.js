@@ -39,6 +39,15 @@ function parse_tiled_upscale_args() {
 	//   tile image source
 	let source = div.getElementsByClassName("tiling-source")[0]
 	args["job"]["tile_source"] = source.options[source.selectedIndex].value
+	//   compositing mode
+	let compositor = div.getElementsByClassName("tiling-compositor")[0]
+	args["job"]["compositor"] = compositor.options[compositor.selectedIndex].value
+	//   canvas storage precision
+	let canvas_dtype = div.getElementsByClassName("tiling-canvas-dtype")[0]
+	args["job"]["canvas_dtype"] = canvas_dtype.options[canvas_dtype.selectedIndex].value
+	//   canvas storage backend
+	let canvas_backend = div.getElementsByClassName("tiling-canvas-backend")[0]
+	args["job"]["canvas_backend"] = canvas_backend.options[canvas_backend.selectedIndex].value
 	//   noise source
 	let noise = div.getElementsByClassName("tiling-noise")[0]
 	args["job"]["tile_noise"] = noise.options[noise.selectedIndex].value
@@ -52,6 +61,9 @@ function parse_tiled_upscale_args() {
 	//   image height
 	let height = div.getElementsByClassName("image-height")[0]
 	args["job"]["image_height"] = parseInt(height.value)
+	//   resize mode
+	let resize_mode = div.getElementsByClassName("image-resize-mode")[0]
+	args["job"]["resize_mode"] = resize_mode.options[resize_mode.selectedIndex].value
 	//   workflow scale
 	let factor = div.getElementsByClassName("tiling-upscale-factor")[0]
 	args["job"]["upscale_factor"] = parseFloat(factor.value)
@@ -71,15 +71,55 @@ async function update_status() {
 	set_status(data)
 }
 
+function set_preview(data) {
+	// new preview available, only fetched if it's being displayed
+	if (main_display != "preview") {
+		return
+	}
+	let out = document.getElementById("out")
+	let src = `/api/exec/preview?t=${data.changed}`
+	if (out.src != src) {
+		out.src = src
+	}
+}
+
+// pushed status/progress/preview events, polling is only used as a fallback
+var status_stream = null
+var status_stream_ok = false
+function start_status_stream() {
+	if (!window.EventSource) {
+		return
+	}
+	status_stream = new EventSource("/api/exec/events")
+	status_stream.onopen = function() {
+		status_stream_ok = true
+	}
+	status_stream.onerror = function() {
+		// browser reconnects on its own, poll in the meantime
+		status_stream_ok = false
+	}
+	status_stream.addEventListener("status", function(e) {
+		set_status(JSON.parse(e.data))
+	})
+	status_stream.addEventListener("progress", function(e) {
+		set_status({"status": "proc", "progress": JSON.parse(e.data)})
+	})
+	status_stream.addEventListener("preview", function(e) {
+		set_preview(JSON.parse(e.data))
+	})
+}
+
 var status_fail_count = 1
 async function update_status_loop() {
 	try {
-		let data = await fetch("/api/exec/status")
-		if (!data.ok) {
-			throw new Error(`${data.statusText}`)
+		if (!status_stream_ok) {
+			let data = await fetch("/api/exec/status")
+			if (!data.ok) {
+				throw new Error(`${data.statusText}`)
+			}
+			data = await data.json()
+			set_status(data)
 		}
-		data = await data.json()
-		set_status(data)
 		status_fail_count = 0
 		// not sure when it's best to poll this
 		update_worker_list()
@@ -0,0 +1,159 @@
+// deep zoom viewer for the current job, only the visible pyramid tiles are fetched
+zoom_info = null
+zoom_view = {
+	"scale": 1.0, // screen px per output px
+	"x": 0.0, // output px at the left/top edge of the screen
+	"y": 0.0,
+}
+zoom_tiles = {} // "level/col/row" => img
+zoom_versions = {} // "level/col/row" => version, bumped when a tile in the area finished
+
+function zoom_get_level() {
+	// coarsest level that still has at least one pixel per screen pixel
+	let level = zoom_info.max_level - Math.floor(Math.log2(1.0 / zoom_view.scale))
+	return Math.min(Math.max(level, 0), zoom_info.max_level)
+}
+
+function zoom_render() {
+	if (!zoom_info) {
+		return
+	}
+	let div = document.getElementById("zoom")
+	let level = zoom_get_level()
+	let factor = 2**(zoom_info.max_level - level)
+	let size = zoom_info.tile_size * factor // output px per pyramid tile
+	let col_start = Math.max(Math.floor(zoom_view.x / size), 0)
+	let row_start = Math.max(Math.floor(zoom_view.y / size), 0)
+	let col_end = Math.min(Math.ceil((zoom_view.x + div.clientWidth / zoom_view.scale) / size), Math.ceil(zoom_info.width / size))
+	let row_end = Math.min(Math.ceil((zoom_view.y + div.clientHeight / zoom_view.scale) / size), Math.ceil(zoom_info.height / size))
+
+	let visible = {}
+	for (let row = row_start; row < row_end; row++) {
+		for (let col = col_start; col < col_end; col++) {
+			let key = `${level}/${col}/${row}`
+			let src = `/api/pyramid/job_files/${level}/${col}_${row}.${zoom_info.format}?v=${zoom_versions[key] || 0}`
+			let img = zoom_tiles[key]
+			if (!img) {
+				img = document.createElement("img")
+				div.appendChild(img)
+				zoom_tiles[key] = img
+			}
+			if (img.getAttribute("src") != src) {
+				img.src = src
+			}
+			// edge tiles are smaller, use the actual image size once loaded
+			let width = Math.min(size, zoom_info.width - col*size)
+			let height = Math.min(size, zoom_info.height - row*size)
+			img.style.left = `${(col*size - zoom_view.x) * zoom_view.scale}px`
+			img.style.top = `${(row*size - zoom_view.y) * zoom_view.scale}px`
+			img.style.width = `${width * zoom_view.scale}px`
+			img.style.height = `${height * zoom_view.scale}px`
+			visible[key] = true
+		}
+	}
+	// drop tiles that are no longer visible
+	for (const key in zoom_tiles) {
+		if (!visible[key]) {
+			zoom_tiles[key].remove()
+			delete zoom_tiles[key]
+		}
+	}
+	document.getElementById("zoom-label").innerHTML = `[${zoom_info.width}x${zoom_info.height} | ${Math.round(zoom_view.scale*100)}% | level ${level}/${zoom_info.max_level}]`
+}
+
+function zoom_mark_changed(rect) {
+	// bump version of all pyramid tiles touching the area [h_start, h_end, w_start, w_end]
+	for (let level = 0; level <= zoom_info.max_level; level++) {
+		let size = zoom_info.tile_size * 2**(zoom_info.max_level - level)
+		for (let row = Math.floor(rect[0] / size); row < Math.ceil(rect[1] / size); row++) {
+			for (let col = Math.floor(rect[2] / size); col < Math.ceil(rect[3] / size); col++) {
+				let key = `${level}/${col}/${row}`
+				zoom_versions[key] = (zoom_versions[key] || 0) + 1
+			}
+		}
+	}
+	zoom_render()
+}
+
+function zoom_fit() {
+	let div = document.getElementById("zoom")
+	zoom_view.scale = Math.min(div.clientWidth / zoom_info.width, div.clientHeight / zoom_info.height)
+	zoom_view.x = (zoom_info.width - div.clientWidth / zoom_view.scale) / 2
+	zoom_view.y = (zoom_info.height - div.clientHeight / zoom_view.scale) / 2
+}
+
+async function zoom_load() {
+	let data = await fetch("/api/pyramid/job.json")
+	if (!data.ok) {
+		zoom_info = null
+		document.getElementById("zoom-label").innerHTML = "[no job]"
+		return
+	}
+	zoom_info = await data.json()
+	zoom_versions = {}
+	for (const key in zoom_tiles) {
+		zoom_tiles[key].remove()
+	}
+	zoom_tiles = {}
+	zoom_fit()
+	zoom_render()
+}
+
+document.addEventListener("DOMContentLoaded", function() {
+	let div = document.getElementById("zoom")
+	// zoom around the cursor
+	div.addEventListener("wheel", function(e) {
+		e.preventDefault()
+		if (!zoom_info) {
+			return
+		}
+		let x = zoom_view.x + e.clientX / zoom_view.scale
+		let y = zoom_view.y + e.clientY / zoom_view.scale
+		zoom_view.scale = Math.min(Math.max(zoom_view.scale * (e.deltaY < 0 ? 1.25 : 0.8), 0.01), 8.0)
+		zoom_view.x = x - e.clientX / zoom_view.scale
+		zoom_view.y = y - e.clientY / zoom_view.scale
+		zoom_render()
+	}, { passive: false })
+	// pan
+	let drag = null
+	div.addEventListener("mousedown", function(e) {
+		drag = [e.clientX, e.clientY]
+		div.style.cursor = "grabbing"
+	})
+	window.addEventListener("mouseup", function(e) {
+		drag = null
+		div.style.cursor = "grab"
+	})
+	window.addEventListener("mousemove", function(e) {
+		if (!drag || !zoom_info) {
+			return
+		}
+		zoom_view.x -= (e.clientX - drag[0]) / zoom_view.scale
+		zoom_view.y -= (e.clientY - drag[1]) / zoom_view.scale
+		drag = [e.clientX, e.clientY]
+		zoom_render()
+	})
+	window.addEventListener("resize", zoom_render)
+	div.addEventListener("dblclick", function() {
+		zoom_fit()
+		zoom_render()
+	})
+
+	// refresh tiles as the job progresses
+	let events = new EventSource("/api/exec/events")
+	let last_status = null
+	events.addEventListener("status", function(e) {
+		let data = JSON.parse(e.data)
+		// new job started
+		if (data.status == "proc" && last_status != "proc") {
+			zoom_load()
+		}
+		last_status = data.status
+	})
+	events.addEventListener("tile", function(e) {
+		let data = JSON.parse(e.data)
+		if (zoom_info && data.state == "done" && data.rect) {
+			zoom_mark_changed(data.rect)
+		}
+	})
+});